@@ -1,3 +1,10 @@
+import os
+import storage
 import usb_cdc
 
-usb_cdc.enable(console=True, data=True)    # Enable console and data
\ No newline at end of file
+usb_cdc.enable(console=True, data=True)    # Enable console and data
+
+# Let code.py keep profiles in /sd on the internal flash when there is no SD card.
+# CIRCUITPY becomes read-only over USB, so only set it once the code is final
+if os.getenv("PROFILE_STORE_WRITABLE"):
+    storage.remount("/", readonly=False)
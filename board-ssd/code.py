@@ -13,11 +13,24 @@ import digitalio
 import analogio
 import usb_hid
 import usb_cdc
+import supervisor
 from adafruit_hid.keyboard import Keyboard
 from adafruit_hid.keycode import Keycode
-from framework_is31fl3743 import IS31FL3743
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+from framework_is31fl3743 import IS31FL3743, PREFER_BUFFER, NUM_LEDS
+import gc
+import os
 import json
+import struct
+import binascii
+import math
 import traceback
+import array
+
+try:
+    import alarm
+except ImportError:
+    alarm = None    # No low-power wait, sleep mode polls GP0 instead
 
 
 
@@ -26,10 +39,79 @@ MATRIX_COLS = 8
 MATRIX_ROWS = 4 
 
 ADC_THRESHOLD = 0.4
+ADC_THRESHOLD_RAW = math.ceil(ADC_THRESHOLD * 65536 / 3.3)  # Same threshold in raw ADC units, 7944
 DEBUG = False
 
-# List of (being) pressed keys at each moment
-pressed = []
+# === Scan Scheduling Configuration ===
+SCAN_IDLE_MS = 10           # Scan period while no key has been used recently
+SCAN_ACTIVE_HOLD_MS = 1000  # Keep scanning flat out this long after the last key activity
+SERIAL_POLL_MS = 20         # Period for checking the serial port for new configs
+STATS_WINDOW_MS = 1000      # Window over which the scan rate and latency are measured
+
+# === Host Sleep Configuration ===
+SLEEP_CHECK_S = 5           # Longest low-power wait before looking at GP0 again
+SLEEP_POLL_MS = 50          # Poll period of GP0 when pin alarms are not available
+
+# === Instrumentation Configuration ===
+# Timing is off until the host sends "STATS ON": time.monotonic_ns() is a
+# long int past the first second of uptime, so each sample allocates twice
+STATS_ENABLED = False       # Time scans, keys, HID reports and config loads. Toggled with "STATS ON|OFF"
+STATS_BUCKETS = 16          # Histogram buckets, bucket n counts samples under 2**n us
+STATS_CALIBRATE = 50        # Samples timed to measure the cost of the instrumentation itself
+
+# === Key Event Queue Configuration ===
+EVENT_QUEUE_SIZE = 32       # Key edges waiting to be acted on. A full queue defers new edges to the next scan
+
+# === Serial Receiver Configuration ===
+RX_BUFFER_SIZE = 8192       # Largest message accepted from the host, newline included
+
+# === Binary Profile Wire Format ===
+# Magic byte, version, body length (uint16 LE), body, CRC32 of the body (uint32 LE).
+# The body holds raw RGB for every key in WIRE_KEYS order, then a count byte
+# and the key entries: chord mask over WIRE_KEYS (uint32), kind (uint8), and
+# for macros the press and release ops, for messages the UTF-8 text, each
+# one preceded by its length (uint16)
+WIRE_MAGIC = 0xA5
+WIRE_DELTA_MAGIC = 0xA6     # Same framing, body patches the active profile
+WIRE_VERSION = 1
+WIRE_HEADER_SIZE = 4
+WIRE_CRC_SIZE = 4
+WIRE_MACRO = 0
+WIRE_MESSAGE = 1
+WIRE_KEYS = [
+    "a1", "a2", "a3", "a4", "b1", "b2", "b3", "b4", "c1", "c2", "c3", "c4",
+    "d1", "d2", "d3", "d4", "e1", "e2", "e3", "e4", "f1", "f2", "f3", "f4"
+]
+WIRE_COLORS_SIZE = 3 * len(WIRE_KEYS)
+# Delta body: sequence number (uint16), base and resulting profile IDs (uint32),
+# then changed colors (count, then wire key index and RGB for each), removed
+# chords (count, then their masks) and added or changed key entries (count,
+# then entries as in the full body)
+
+# === Profile Cache Configuration ===
+# Binary profiles are cached by ID (the CRC32 of their body), so the host can
+# switch to one with "ACTIVATE <id>" instead of sending it again
+PROFILE_CACHE_MAX = 8               # Most profiles kept
+PROFILE_CACHE_MIN_FREE = 32 * 1024  # Evict least recently used profiles while free RAM is below this
+
+# === Profile Store Configuration ===
+# Profiles the host asks to keep with "STORE <id> <name>" are written to the
+# SD card, so they survive a power cycle. "LOAD <name>" activates one, and
+# the one named "default" is activated on start up
+PROFILE_STORE_DIR = "/sd"
+PROFILE_STORE_INDEX = PROFILE_STORE_DIR + "/profiles.idx"   # Fixed size records, see STORE_RECORD
+PROFILE_STORE_DATA = PROFILE_STORE_DIR + "/profiles.dat"    # Profile bodies, appended
+PROFILE_STORE_MAX_SIZE = 64 * 1024  # Compact the data file once it grows past this
+PROFILE_STORE_MAX_NAMES = 32        # Oldest names beyond this are forgotten, except "default"
+PROFILE_STORE_NAME_SIZE = 20
+STORE_RECORD = "<III20sI"           # Profile ID, data offset, data size, name, CRC32 of the data
+STORE_RECORD_SIZE = struct.calcsize(STORE_RECORD)
+
+# Bitmask of pressed keys, bit n set when KEYS[n] is pressed. Follows the
+# events as they are acted on, so it always holds the chord of the current event
+key_state = 0
+# Same bitmask as last queued by the scan, ahead of key_state while events wait
+scan_state = 0
 
 # Matrix layout mapping logical keys to physical positions
 MATRIX = [
@@ -39,6 +121,16 @@ MATRIX = [
     [None, None, None, None, "a3", None, None, None]
 ]
 
+# Logical keys present in the matrix, indexed by their bit in key_state
+KEYS = []
+for matrix_row in MATRIX:
+    for key in matrix_row:
+        if key and key not in KEYS:
+            KEYS.append(key)
+
+# key_state bit of each key in the wire format order, 0 if not in the matrix
+WIRE_KEY_BITS = [1 << KEYS.index(key) if key in KEYS else 0 for key in WIRE_KEYS]
+
 # Mapping from logical key names to LED controller indices
 MATRIX_LED_MAP = {
     "a1" : 40,  "a2" : 37,  "a3" : 52,  "a4" : 49,
@@ -49,15 +141,50 @@ MATRIX_LED_MAP = {
     "f1" : 7,   "f2" : 43,  "f3" : 46,  "f4" : 10
 }
 
+# LED channels used by the keys (blue, green, red for each one), in register order
+LED_CHANNELS = sorted(led + offset for led in MATRIX_LED_MAP.values() for offset in range(3))
+
+# Unchanged channels this close together are resent rather than starting a new write
+LED_RUN_GAP = 2
 
-# Key symbol mapping will be loaded from configuration
-SYMBOLS = {}
+# Decoded colors requested by the configuration, and last values sent to the controller
+LED_FRAME = bytearray(NUM_LEDS)
+LED_SHADOW = bytearray(NUM_LEDS)
+
+# LED controller index of each key in the wire format order
+WIRE_KEY_LEDS = [MATRIX_LED_MAP[key] for key in WIRE_KEYS]
+
+
+# Key symbols from the configuration, resolved to keycodes by load_symbols.
+# Indexed by character code, 0 when the character has no key
+SYMBOL_TABLE_SIZE = 128
+SYMBOL_KEYS = bytearray(SYMBOL_TABLE_SIZE)
+SYMBOL_ESCAPES = bytearray(SYMBOL_TABLE_SIZE)  # Keys of \ escapes, by the character after it
 MATRIX_COLORS = {}
 MATRIX_COMMANDS = {}
 
+# Key commands compiled by load_config, indexed by the bitmask of the keys
+# in the chord. Each entry is either the message string of a "MSG:" command,
+# or a (press_ops, release_ops) pair of bytes
+MATRIX_ACTIONS = {}
+
+CHORD_MAX_KEYS = 4
+
+# Compiled macro operations. Every op takes two bytes: opcode and argument
+OP_PRESS = 0    # Press keycode
+OP_RELEASE = 1  # Release keycode
+OP_TAP = 2      # Press and release keycode
+OP_DELAY = 3    # Wait argument * 10 ms, without blocking the scan
+
+MACRO_PAUSE_MS = 150  # Default \p pause. Profiles may set their own "pause_ms"
+MACRO_DELAY = MACRO_PAUSE_MS // 10  # \p pause of the active profile, in 10 ms units
+MACRO_OPS_PER_STEP = 4  # Macro ops run per pass of the main loop, the rest wait for the next scan
+
 
 # Initialize USB HID keyboard device
 keyboard = Keyboard(usb_hid.devices)
+# Layout used to type text resolved by the host. The host only sends it when its own layout matches
+keyboard_layout = KeyboardLayoutUS(keyboard)
 
 # Set unused pins to input to avoid interfering. They're hooked up to rows 5 and 6
 
@@ -99,6 +226,15 @@ for kso in kso_pins:
     kso.direction = digitalio.Direction.OUTPUT
     kso.value = 1
 
+# Populated matrix positions as (row, column pin, key bit). Row-major order,
+# so the multiplexer only switches once per row
+SCAN_TABLE = [
+    (row, kso_pins[col], 1 << KEYS.index(MATRIX[row][col]))
+    for row in range(MATRIX_ROWS)
+    for col in range(MATRIX_COLS)
+    if MATRIX[row][col]
+]
+
 
 # Analog input used to read voltage from the key multiplexer
 adc_in = analogio.AnalogIn(board.GP28)
@@ -123,9 +259,6 @@ def drive_col(col, value):
     kso_pins[col].value = value
 
 
-def to_voltage(adc_sample):
-    return (adc_sample * 3.3) / 65536
-
 # Enable LED controller via SDB pin
 
 # === LED Driver Initialization ===
@@ -144,7 +277,8 @@ i2c.unlock()
 
 
 # Initialize and configure IS31FL3743 LED controller
-is31 = IS31FL3743(i2c)
+# Buffered, so a full repaint goes out as one I2C write on show()
+is31 = IS31FL3743(i2c, allocate=PREFER_BUFFER)
 is31.set_led_scaling(0x20)  # Brightness
 is31.global_current = 0x20  # Current 
 is31.enable = True
@@ -158,125 +292,367 @@ sleep_pin = digitalio.DigitalInOut(board.GP0)
 sleep_pin.direction = digitalio.Direction.INPUT
 
 
-# === Update LED Colors Based on Configuration ===
-def matrix_paint():
+# === Wait for the Host to Wake Up ===
+def sleep_wait():
+    ## Returns as soon as GP0 goes high, or after SLEEP_CHECK_S at most.
+    ## The pin alarm needs GP0 to itself, so the input is released meanwhile
+    global sleep_pin
 
-# Mapping from logical key names to LED controller indices
-    global MATRIX_LED_MAP
-    global MATRIX_COLORS
+    if alarm is None:
+        time.sleep(SLEEP_POLL_MS / 1000)
+        return
 
-# Mapping from logical key names to LED controller indices
-    for key in MATRIX_LED_MAP.keys():
-        value = MATRIX_COLORS.get(key,None)
-        if value:
-            # Mapping from logical key names to LED controller indices
-            is31[MATRIX_LED_MAP[key] +2 ] = int(value[:2],16)
-            is31[MATRIX_LED_MAP[key] +1 ] = int(value[2:4],16)
-            is31[MATRIX_LED_MAP[key] +0 ] = int(value[-2:],16)
-        else:
-            # Setting LED to OFF
-            is31[MATRIX_LED_MAP[key] +2 ] = 0x00
-            is31[MATRIX_LED_MAP[key] +1 ] = 0x00
-            is31[MATRIX_LED_MAP[key] +0 ] = 0x00
+    sleep_pin.deinit()
+    try:
+        alarm.light_sleep_until_alarms(
+            alarm.pin.PinAlarm(pin=board.GP0, value=True),
+            alarm.time.TimeAlarm(monotonic_time=time.monotonic() + SLEEP_CHECK_S),
+        )
+    except Exception as e:
+        print(f"Could not wait for GP0: {e}")
+        time.sleep(SLEEP_POLL_MS / 1000)
+    finally:
+        sleep_pin = digitalio.DigitalInOut(board.GP0)
+        sleep_pin.direction = digitalio.Direction.INPUT
 
 
-# === Handle Key Press Logic ===
-def process_key(key, is_pressed):
-    global pressed
-    global MATRIX_COMMANDS
-    global SYMBOLS
+# === Decode Configured Colors into the LED Frame ===
+def decode_colors(colors):
+    global MATRIX_LED_MAP
+    global LED_FRAME
 
-    if len(pressed)>1:
-        key = "-".join(pressed)
-    code = MATRIX_COMMANDS.get(key, None)
+    for key, led in MATRIX_LED_MAP.items():
+        value = colors.get(key,None)
+        rgb = int(value,16) if value else 0x000000
+        LED_FRAME[led +2 ] = rgb >> 16
+        LED_FRAME[led +1 ] = (rgb >> 8) & 0xFF
+        LED_FRAME[led +0 ] = rgb & 0xFF
 
-    if not code:
-        ## No code for this key
-        return
-    elif is_pressed and code[0:4] == "MSG:":
-        ## Process message key function
-        to_send = {
-            "key": key,
-            "code": code[4:],
-            "pressed": is_pressed
-        }
-        usb_serial.write((json.dumps(to_send) + '\n').encode())
-        usb_serial.flush()
-        return
 
-    ## Process normal key function
+# === Update LED Colors Based on Configuration ===
+def matrix_paint():
+    global LED_FRAME
+    global LED_SHADOW
+
+    ## Only changed channels are sent, grouped in contiguous register runs
+    start = None
+    end = None
+    for led in LED_CHANNELS:
+        value = LED_FRAME[led]
+        if LED_SHADOW[led] == value:
+            continue
+        LED_SHADOW[led] = value
+        is31[led] = value
+        if start is None:
+            start = led
+        elif led - end > LED_RUN_GAP + 1:
+            is31.show(start, end + 1)
+            start = led
+        end = led
+
+    if start is not None:
+        is31.show(start, end + 1)
+
+
+# === Resolve Configured Symbols into Keycode Tables ===
+def load_symbols(symbols):
+    for i in range(SYMBOL_TABLE_SIZE):
+        SYMBOL_KEYS[i] = 0
+        SYMBOL_ESCAPES[i] = 0
+
+    for key, symbol in symbols.items():
+        table = SYMBOL_KEYS
+        if len(key) == 2 and key[0] == '\\':
+            table = SYMBOL_ESCAPES
+            key = key[1]
+        if len(key) != 1 or ord(key) >= SYMBOL_TABLE_SIZE:
+            print(f"Ignoring symbol {key}")
+            continue
+        key_code = getattr(Keycode, symbol, None)
+        if key_code is None:
+            print(f"Could not find code for {symbol}")
+            continue
+        ## Symbols are matched regardless of case
+        table[ord(key.upper())] = key_code
+        table[ord(key.lower())] = key_code
+
+
+# === Compile Key Macros into Keycode Operations ===
+def compile_macro(code):
+    press_ops = bytearray()
+    release_ops = bytearray()
     escaped = False
     for key in code:
-        press = is_pressed
-        release = True
-
+        table = SYMBOL_KEYS
         if escaped:
-            ## Within escaped code
+            ## Within escaped code. Uppercase holds the key until released
             escaped = False
-            if key == key.upper():
-                release = False
-            else:
-                release = True
-
-            if key.upper() =='P':
-                time.sleep(0.15)
-                key = None
+            if key.upper() == 'P':
+                if MACRO_DELAY:
+                    press_ops.extend((OP_DELAY, MACRO_DELAY))
+                    release_ops.extend((OP_DELAY, MACRO_DELAY))
                 continue
-            else:
-                key = "\\" + key
+            hold = key == key.upper()
+            table = SYMBOL_ESCAPES
+        elif key == '\\':
+            escaped = True
+            continue
         else:
-            ## Within normal operation
-            if key == '\\':
-                escaped = True
-                key = None
-                continue
-            else:
-                escaped = False
-
-
-        # Actually press and/or release the keys
-        if key:
-            ## Resolve key
-            symbol = SYMBOLS.get(key.upper(),None)
-            if symbol:
-                key_code = getattr(Keycode, symbol)
-                if key_code:
-                    press and keyboard.press(key_code)
-                    release and keyboard.release(key_code)
-                else:
-                    print (f"Could not find code for {symbol}")
-            else:
-                print (f"Could not find key {key}")
+            hold = False
+
+        code_point = ord(key)
+        key_code = table[code_point] if code_point < SYMBOL_TABLE_SIZE else 0
+        if not key_code:
+            print(f"Could not find key {key}")
+            continue
+        if hold:
+            press_ops.extend((OP_PRESS, key_code))
+        else:
+            press_ops.extend((OP_TAP, key_code))
+            release_ops.extend((OP_RELEASE, key_code))
+
+    return bytes(press_ops), bytes(release_ops)
+
+
+def chord_mask(chord):
+    names = chord.split("-")
+    if len(names) > CHORD_MAX_KEYS:
+        print(f"Too many keys in {chord}")
+        return 0
+    mask = 0
+    for name in names:
+        if name not in KEYS:
+            print(f"Could not find key {name} in {chord}")
+            return 0
+        mask |= 1 << KEYS.index(name)
+    return mask
+
+
+def chord_name(mask):
+    ## The same chord always gets the same name, in KEYS order, whatever the
+    ## order it was configured or sent in
+    return "-".join(KEYS[index] for index in range(len(KEYS)) if mask & (1 << index))
+
+
+def compile_commands(commands):
+    actions = {}
+    for key, code in commands.items():
+        if not code:
+            continue
+        mask = chord_mask(key)
+        if not mask:
+            continue
+        if code[0:4] == "MSG:":
+            actions[mask] = code[4:]
+        else:
+            actions[mask] = compile_macro(code)
+    return actions
+
+
+# === Run Macros Between Scans ===
+## Macros queue up in key order and advance MACRO_OPS_PER_STEP ops per loop
+## iteration. A delay only sets the tick to resume at, so keys keep being
+## scanned meanwhile
+macro_queue = []            # (ops, release_all) waiting to run, oldest first
+macro_ops = None            # Ops being run, None when idle
+macro_pos = 0
+macro_release_all = False   # Release every key once the ops are done
+macro_resume = 0            # Tick at which a delayed macro carries on
+
+
+def macro_start(ops, release_all=False):
+    ## Run by the main loop, right after the key events
+    macro_queue.append((ops, release_all))
+
+
+def macro_busy():
+    return macro_ops is not None or bool(macro_queue)
+
+
+def macro_cancel():
+    global macro_ops
+    macro_queue.clear()
+    macro_ops = None
+
+
+def macro_step(now):
+    global macro_ops, macro_pos, macro_release_all, macro_resume
+
+    budget = MACRO_OPS_PER_STEP
+    while True:
+        if macro_ops is None:
+            if not macro_queue:
+                return
+            macro_ops, macro_release_all = macro_queue.pop(0)
+            macro_pos = 0
+        elif ticks_diff(macro_resume, now) > 0:
+            ## Still waiting
+            return
+
+        ops = macro_ops
+        while macro_pos < len(ops):
+            if not budget:
+                ## Carry on after the next scan
+                macro_resume = now
+                return
+            budget -= 1
+            op = ops[macro_pos]
+            arg = ops[macro_pos + 1]
+            macro_pos += 2
+            if op == OP_DELAY:
+                macro_resume = ticks_add(now, arg * 10)
+                return
+            start = stat_start()
+            if op == OP_TAP:
+                keyboard.press(arg)
+                keyboard.release(arg)
+            elif op == OP_PRESS:
+                keyboard.press(arg)
+            elif op == OP_RELEASE:
+                keyboard.release(arg)
+            stat_end(STAT_HID, start)
+
+        macro_release_all and keyboard.release_all()
+        macro_ops = None
+
+
+# === Type Text Sent by the Host ===
+## The host answers MSG:TYPE keys with the text to type, which goes through
+## the macro queue at full HID report rate instead of host side key events
+def compile_text(text):
+    ops = bytearray()
+    for char in text:
+        try:
+            key_codes = keyboard_layout.keycodes(char)
+        except ValueError:
+            print(f"Could not find key {char}")
+            continue
+        modifiers = key_codes[:-1]
+        for key_code in modifiers:
+            ops.extend((OP_PRESS, key_code))
+        ops.extend((OP_TAP, key_codes[-1]))
+        for key_code in modifiers:
+            ops.extend((OP_RELEASE, key_code))
+    return bytes(ops)
+
+
+def type_text(text):
+    macro_start(compile_text(text))
+
+
+# === Handle Key Press Logic ===
+def process_key(key, is_pressed):
+    global key_state
+    global MATRIX_ACTIONS
+
+    ## The chord is every key held, including the one just pressed or released
+    action = MATRIX_ACTIONS.get(key_state, None)
+
+    if not action:
+        ## No code for this key
+        return
+    elif isinstance(action, str):
+        if is_pressed:
+            ## Process message key function
+            to_send = {
+                "key": chord_name(key_state),
+                "code": action,
+                "pressed": is_pressed
+            }
+            usb_serial.write((json.dumps(to_send) + '\n').encode())
+            usb_serial.flush()
+            return
+    else:
+        ## Process normal key function. Releasing also lets go of everything, just in case
+        macro_start(action[0] if is_pressed else action[1], not is_pressed)
+        return
 
     # Just in case    
-    is_pressed or keyboard.release_all()
+    is_pressed or macro_start(b"", True)
 
 
 # === Scan Matrix and Detect Key Events ===
 def matrix_scan():
-    global pressed
-
-# === Matrix and Threshold Configuration ===
-    global MATRIX_COLS
-    global MATRIX_ROWS
-    global MATRIX
-
-# === Matrix and Threshold Configuration ===
-    for col in range(MATRIX_COLS):
-        drive_col(col, 0)
-        for row in range(MATRIX_ROWS):
-            key = MATRIX[row][col]
-            if key:
-                mux_select_row(row)
-                if to_voltage(adc_in.value) < ADC_THRESHOLD:
-                    if not key in pressed:
-                        pressed.append(key)
-                        process_key(key, True)
-                else:
-                    if key in pressed:
-                        process_key(key, False)
-                        pressed.remove(key)
-        drive_col(col, 1)
+    state = 0
+    mux_row = None
+    for row, kso, bit in SCAN_TABLE:
+        if row != mux_row:
+            mux_select_row(row)
+            mux_row = row
+        kso.value = 0
+        if adc_in.value < ADC_THRESHOLD_RAW:
+            state |= bit
+        kso.value = 1
+
+    if state != scan_state:
+        matrix_edges(state)
+
+
+def matrix_edges(state):
+    global scan_state
+
+    now = supervisor.ticks_ms()
+    changed = state ^ scan_state
+    for index in range(len(KEYS)):
+        bit = 1 << index
+        if not changed & bit:
+            continue
+        if not event_push(index, state & bit, now):
+            ## Queue full. The edge stays pending and is queued again on the next scan
+            continue
+        scan_state ^= bit
+
+
+# === Queue Key Events for the Executor ===
+## The scan only records timestamped edges. events_run() replays them in
+## order, so a slow action never hides or reorders the edges behind it
+event_keys = bytearray(EVENT_QUEUE_SIZE)    # KEYS index << 1 | pressed
+event_ticks = array.array("L", [0] * EVENT_QUEUE_SIZE)
+event_start = 0
+event_len = 0
+event_lag_max = 0
+
+EVENT_OVERFLOWS = 0     # Edges deferred to a later scan because the queue was full
+EVENT_QUEUE_PEAK = 0    # Most events ever waiting at once
+EVENT_LATENCY_MAX = 0   # Longest wait (ms) of an event in the last stats window
+
+
+def event_push(index, pressed, now):
+    global event_len, EVENT_OVERFLOWS, EVENT_QUEUE_PEAK
+
+    if event_len == EVENT_QUEUE_SIZE:
+        EVENT_OVERFLOWS += 1
+        return False
+    pos = (event_start + event_len) % EVENT_QUEUE_SIZE
+    event_keys[pos] = index << 1 | (1 if pressed else 0)
+    event_ticks[pos] = now
+    event_len += 1
+    if event_len > EVENT_QUEUE_PEAK:
+        EVENT_QUEUE_PEAK = event_len
+    return True
+
+
+def events_run(now):
+    global key_state, event_start, event_len, event_lag_max
+
+    while event_len:
+        code = event_keys[event_start]
+        lag = ticks_diff(now, event_ticks[event_start])
+        event_start = (event_start + 1) % EVENT_QUEUE_SIZE
+        event_len -= 1
+        if lag > event_lag_max:
+            event_lag_max = lag
+
+        index = code >> 1
+        bit = 1 << index
+        start = stat_start()
+        if code & 1:
+            key_state |= bit
+            process_key(KEYS[index], True)
+        else:
+            process_key(KEYS[index], False)
+            key_state &= ~bit
+        stat_end(STAT_KEY, start)
 
 
 
@@ -284,18 +660,697 @@ def matrix_scan():
 def load_config(config):
     global MATRIX_COLORS
     global MATRIX_COMMANDS  
-    global SYMBOLS
+    global MATRIX_ACTIONS
+    global ACTIVE_PROFILE_ID
+    global MACRO_DELAY
     MATRIX_COLORS = config['colors']
+    decode_colors(MATRIX_COLORS)
     MATRIX_COMMANDS = config['keys']
     if config.get('symbols',None):
-        SYMBOLS = config['symbols']
+        load_symbols(config['symbols'])
+    MACRO_DELAY = min(config.get('pause_ms', MACRO_PAUSE_MS) // 10, 255)
+    MATRIX_ACTIONS = compile_commands(MATRIX_COMMANDS)
+    ACTIVE_PROFILE_ID = None
+    matrix_paint()
+
+
+# === Load Precompiled Key and LED Configuration from the Binary Format ===
+ACTIVE_PROFILE = None       # Active binary profile (colors, actions)
+ACTIVE_PROFILE_ID = None    # Its ID, None when the configuration came as JSON
+PROFILE_SEQ = None          # Sequence number of the last delta applied, None to take any
+
+
+def wire_body(data):
+    ## The body and its CRC32 from the trailer. The body is None if it cannot be used
+    size = data[2] | data[3] << 8
+    body = memoryview(data)[WIRE_HEADER_SIZE:WIRE_HEADER_SIZE + size]
+    crc = struct.unpack_from("<I", data, WIRE_HEADER_SIZE + size)[0]
+    if data[1] != WIRE_VERSION:
+        print(f"Unsupported profile version {data[1]}")
+        return None, crc
+    if crc != binascii.crc32(body):
+        print("Bad profile checksum")
+        return None, crc
+    return body, crc
+
+
+def load_wire(data):
+    body, profile_id = wire_body(data)
+    if body is None:
+        ## The trailer is the ID the host gave it, ask for it again
+        send_host(f"MISS:{profile_id:08x}")
+        return
+
+    actions = {}
+    decode_entries(body, WIRE_COLORS_SIZE, actions)
+    ## Raw colors are kept as sent, in WIRE_KEYS order
+    profile = (bytes(body[:WIRE_COLORS_SIZE]), actions)
+    profile_cache_put(profile_id, profile)
+    activate_profile(profile_id, profile)
+
+
+def load_delta(data):
+    global PROFILE_SEQ
+
+    body, _ = wire_body(data)
+    if body is None:
+        ## Ask for the profile it was for whole, as when out of sync
+        profile_id = struct.unpack_from("<I", data, WIRE_HEADER_SIZE + 6)[0]
+        send_host(f"RESYNC:{profile_id:08x}")
+        PROFILE_SEQ = None
+        return
+
+    seq, base_id, profile_id = struct.unpack_from("<HII", body, 0)
+    if base_id != ACTIVE_PROFILE_ID or (
+        PROFILE_SEQ is not None and seq != (PROFILE_SEQ + 1) & 0xFFFF
+    ):
+        ## Out of sync with the host, ask for the full profile. The next
+        ## delta starts the count again
+        send_host(f"RESYNC:{profile_id:08x}")
+        PROFILE_SEQ = None
+        return
+
+    ## Patch copies, the active profile may also be in the cache
+    colors = bytearray(ACTIVE_PROFILE[0])
+    actions = dict(ACTIVE_PROFILE[1])
+
+    pos = 10
+    count = body[pos]
+    pos += 1
+    for _ in range(count):
+        index = body[pos] * 3
+        colors[index:index + 3] = body[pos + 1:pos + 4]
+        pos += 4
+
+    count = body[pos]
+    pos += 1
+    for _ in range(count):
+        mask = wire_chord_mask(struct.unpack_from("<I", body, pos)[0])
+        pos += 4
+        actions.pop(mask, None)
+
+    decode_entries(body, pos, actions)
+    profile = (bytes(colors), actions)
+    profile_cache_put(profile_id, profile)
+    activate_profile(profile_id, profile)
+    PROFILE_SEQ = seq
+
+
+def decode_entries(body, pos, actions):
+    count = body[pos]
+    pos += 1
+    for _ in range(count):
+        wire_mask, kind, size = struct.unpack_from("<IBH", body, pos)
+        pos += 7
+        first = bytes(body[pos:pos + size])
+        pos += size
+        if kind == WIRE_MESSAGE:
+            action = first.decode()
+        else:
+            size = struct.unpack_from("<H", body, pos)[0]
+            pos += 2
+            action = (first, bytes(body[pos:pos + size]))
+            pos += size
+
+        mask = wire_chord_mask(wire_mask)
+        if mask:
+            actions[mask] = action
+
+
+def wire_chord_mask(wire_mask):
+    ## Translate a chord from wire order to key_state bits, 0 if not in the matrix
+    mask = 0
+    for index in range(len(WIRE_KEYS)):
+        if wire_mask & (1 << index):
+            if not WIRE_KEY_BITS[index]:
+                return 0
+            mask |= WIRE_KEY_BITS[index]
+    return mask
+
+
+def activate_profile(profile_id, profile):
+    global MATRIX_ACTIONS
+    global LED_FRAME
+    global ACTIVE_PROFILE, ACTIVE_PROFILE_ID
+
+    ACTIVE_PROFILE = profile
+    ACTIVE_PROFILE_ID = profile_id
+    colors, MATRIX_ACTIONS = profile
+    pos = 0
+    for led in WIRE_KEY_LEDS:
+        LED_FRAME[led +2 ] = colors[pos]
+        LED_FRAME[led +1 ] = colors[pos + 1]
+        LED_FRAME[led +0 ] = colors[pos + 2]
+        pos += 3
     matrix_paint()
 
 
+def send_host(code):
+    usb_serial.write((json.dumps({"code": code}) + '\n').encode())
+    usb_serial.flush()
+
+
+# === On-Device Profile Cache ===
+PROFILE_CACHE = {}      # Profile ID -> decoded (colors, actions)
+PROFILE_LRU = []        # Cached profile IDs, least recently used first
+
+
+def profile_cache_put(profile_id, profile):
+    if profile_id in PROFILE_CACHE:
+        PROFILE_LRU.remove(profile_id)
+    PROFILE_CACHE[profile_id] = profile
+    PROFILE_LRU.append(profile_id)
+
+    ## The profile just stored is always kept
+    while len(PROFILE_LRU) > 1 and (
+        len(PROFILE_LRU) > PROFILE_CACHE_MAX or profile_cache_low_memory()
+    ):
+        del PROFILE_CACHE[PROFILE_LRU.pop(0)]
+
+
+def profile_cache_low_memory():
+    if gc.mem_free() >= PROFILE_CACHE_MIN_FREE:
+        return False
+    gc.collect()
+    return gc.mem_free() < PROFILE_CACHE_MIN_FREE
+
+
+def activate_cached(profile_id):
+    profile = PROFILE_CACHE.get(profile_id, None)
+    if profile is not None:
+        PROFILE_LRU.remove(profile_id)
+        PROFILE_LRU.append(profile_id)
+    else:
+        profile = store_load(profile_id)
+        if profile is None:
+            ## Ask the host for the full profile
+            send_host(f"MISS:{profile_id:08x}")
+            return
+        profile_cache_put(profile_id, profile)
+    activate_profile(profile_id, profile)
+
+
+# === Persistent Profile Store ===
+# The data file holds profiles in the binary body layout, but with chords as
+# key_state masks. Only the small index is read at start up, each profile is
+# read from its offset when needed
+STORE_INDEX = []        # [profile ID, offset, size, name, CRC32] for every stored name, oldest first
+store_writable = True
+
+
+def store_name(name):
+    ## Encoded name cut to fit its record, never in the middle of a UTF-8 character
+    data = name.encode()[:PROFILE_STORE_NAME_SIZE]
+    end = len(data)
+    lead = end - 1
+    while lead > 0 and data[lead] & 0xC0 == 0x80:
+        lead -= 1
+    if lead >= 0 and data[lead] >= 0xC0:
+        length = 2 if data[lead] < 0xE0 else 3 if data[lead] < 0xF0 else 4
+        if lead + length > end:
+            end = lead
+    return data[:end]
+
+
+def store_open():
+    global STORE_INDEX
+
+    STORE_INDEX = []
+    ## A new index only replaces the old one once complete. If power was lost
+    ## in between, the complete new one is still under its temporary name
+    for path in (PROFILE_STORE_INDEX, PROFILE_STORE_INDEX + ".tmp"):
+        try:
+            file = open(path, "rb")
+        except OSError:
+            continue
+        with file:
+            record = bytearray(STORE_RECORD_SIZE)
+            while file.readinto(record) == STORE_RECORD_SIZE:
+                profile_id, offset, size, name, crc = struct.unpack(STORE_RECORD, record)
+                try:
+                    name = name.rstrip(b"\0").decode()
+                except UnicodeError:
+                    print(f"Skipping stored profile {profile_id:08x} with a broken name")
+                    continue
+                STORE_INDEX.append([profile_id, offset, size, name, crc])
+        return
+
+
+def store_find(profile_id=None, name=None):
+    for entry in STORE_INDEX:
+        if entry[0] == profile_id or entry[3] == name:
+            return entry
+    return None
+
+
+def store_load(profile_id=None, name=None):
+    entry = store_find(profile_id, name)
+    if entry is None:
+        return None
+    try:
+        body = bytearray(entry[2])
+        with open(PROFILE_STORE_DATA, "rb") as file:
+            file.seek(entry[1])
+            file.readinto(body)
+    except OSError as e:
+        print(f"Could not read stored profile {entry[3]}: {e}")
+        return None
+    if binascii.crc32(body) != entry[4]:
+        ## Index and data file out of step, better ask the host again
+        print(f"Stored profile {entry[3]} is damaged")
+        return None
+
+    actions = {}
+    pos = WIRE_COLORS_SIZE
+    count = body[pos]
+    pos += 1
+    for _ in range(count):
+        mask, kind, size = struct.unpack_from("<IBH", body, pos)
+        pos += 7
+        first = bytes(body[pos:pos + size])
+        pos += size
+        if kind == WIRE_MESSAGE:
+            actions[mask] = first.decode()
+        else:
+            size = struct.unpack_from("<H", body, pos)[0]
+            pos += 2
+            actions[mask] = (first, bytes(body[pos:pos + size]))
+            pos += size
+    return bytes(body[:WIRE_COLORS_SIZE]), actions
+
+
+def store_encode(profile):
+    colors, actions = profile
+    body = bytearray(colors)
+    body.append(len(actions))
+    for mask, action in actions.items():
+        if isinstance(action, str):
+            text = action.encode()
+            body.extend(struct.pack("<IBH", mask, WIRE_MESSAGE, len(text)))
+            body.extend(text)
+        else:
+            body.extend(struct.pack("<IBH", mask, WIRE_MACRO, len(action[0])))
+            body.extend(action[0])
+            body.extend(struct.pack("<H", len(action[1])))
+            body.extend(action[1])
+    return body
+
+
+def store_put(profile_id, name):
+    global store_writable
+
+    if not store_writable:
+        return
+    name = store_name(name).decode()
+    entry = store_find(name=name)
+    if entry is not None and entry[0] == profile_id:
+        ## Already stored under this name, nothing to write
+        return
+
+    ## Several names may share the data of the same profile
+    entry = store_find(profile_id)
+    if entry is not None:
+        offset = entry[1]
+        size = entry[2]
+        crc = entry[4]
+    else:
+        profile = PROFILE_CACHE.get(profile_id, None)
+        if profile is None:
+            ## Not on the pad, the host stores it again after sending it on MISS
+            return
+        body = store_encode(profile)
+        size = len(body)
+        crc = binascii.crc32(body)
+        try:
+            with open(PROFILE_STORE_DATA, "ab") as file:
+                offset = file.seek(0, 2)
+                file.write(body)
+        except OSError as e:
+            ## Read-only filesystem or no card, keep working without the store
+            print(f"Profile store not available: {e}")
+            store_writable = False
+            return
+
+    STORE_INDEX[:] = [entry for entry in STORE_INDEX if entry[3] != name]
+    STORE_INDEX.append([profile_id, offset, size, name, crc])
+    while len(STORE_INDEX) > PROFILE_STORE_MAX_NAMES:
+        STORE_INDEX.pop(1 if STORE_INDEX[0][3] == "default" else 0)
+    if offset + size > PROFILE_STORE_MAX_SIZE:
+        store_compact()
+    else:
+        store_write_index()
+
+
+def store_compact():
+    ## Copy the profiles still named to a new data file, dropping the rest
+    temp = PROFILE_STORE_DATA + ".tmp"
+    offsets = {}
+    offset = 0
+    with open(PROFILE_STORE_DATA, "rb") as source, open(temp, "wb") as target:
+        for entry in STORE_INDEX:
+            if entry[1] not in offsets:
+                body = bytearray(entry[2])
+                source.seek(entry[1])
+                source.readinto(body)
+                target.write(body)
+                offsets[entry[1]] = offset
+                offset += entry[2]
+            entry[1] = offsets[entry[1]]
+    store_write_index(temp)
+
+
+def store_write_index(data_temp=None):
+    ## Write the index aside, then swap it in together with a compacted data file
+    temp = PROFILE_STORE_INDEX + ".tmp"
+    with open(temp, "wb") as file:
+        for profile_id, offset, size, name, crc in STORE_INDEX:
+            file.write(struct.pack(STORE_RECORD, profile_id, offset, size, name.encode(), crc))
+    if data_temp:
+        store_replace(data_temp, PROFILE_STORE_DATA)
+    store_replace(temp, PROFILE_STORE_INDEX)
+
+
+def store_replace(temp, path):
+    ## FAT cannot rename over an existing file
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    os.rename(temp, path)
+
+
+def activate_stored(name):
+    entry = store_find(name=name)
+    if entry is None:
+        print(f"No stored profile {name}")
+        return
+    activate_cached(entry[0])
+
+
+# === Incremental Serial Receiver ===
+# Bytes are read without blocking into a fixed ring buffer as they arrive.
+# JSON messages are newline terminated, binary ones start with WIRE_MAGIC
+# and carry their length. Only complete messages are parsed
+rx_buffer = bytearray(RX_BUFFER_SIZE)
+rx_view = memoryview(rx_buffer)
+rx_start = 0            # Start of the message being received
+rx_len = 0              # Bytes of it received so far
+rx_need = 0             # Full size of a binary message, header size until known
+rx_skip = 0             # Bytes left of an oversized binary message being dropped
+rx_discard = False      # Dropping an oversized JSON message up to its newline
+RX_OVERFLOWS = 0        # Messages dropped because they did not fit in the buffer
+
+
+def rx_byte(offset):
+    return rx_buffer[(rx_start + offset) % RX_BUFFER_SIZE]
+
+
+def serial_receive():
+    global rx_start, rx_len, rx_need, rx_skip, rx_discard, RX_OVERFLOWS
+
+    waiting = usb_serial.in_waiting
+    while waiting:
+        if rx_len == RX_BUFFER_SIZE:
+            ## Message larger than the buffer, drop it
+            print("Serial message too large, dropped")
+            RX_OVERFLOWS += 1
+            rx_discard = True
+            rx_len = 0
+
+        pos = (rx_start + rx_len) % RX_BUFFER_SIZE
+        chunk = min(waiting, RX_BUFFER_SIZE - rx_len, RX_BUFFER_SIZE - pos)
+        got = usb_serial.readinto(rx_view[pos:pos + chunk])
+        if not got:
+            break
+        waiting -= got
+        end = pos + got
+
+        while pos < end:
+            if rx_skip:
+                skipped = min(rx_skip, end - pos)
+                rx_skip -= skipped
+                pos += skipped
+                rx_start = pos % RX_BUFFER_SIZE
+                continue
+
+            if not rx_len and not rx_discard and rx_buffer[pos] in (WIRE_MAGIC, WIRE_DELTA_MAGIC):
+                rx_need = WIRE_HEADER_SIZE
+            if rx_need:
+                ## Binary message, complete once its declared length is in
+                taken = min(end - pos, rx_need - rx_len)
+                rx_len += taken
+                pos += taken
+                if rx_len == WIRE_HEADER_SIZE:
+                    rx_need = WIRE_HEADER_SIZE + (rx_byte(2) | rx_byte(3) << 8) + WIRE_CRC_SIZE
+                    if rx_need > RX_BUFFER_SIZE:
+                        print("Serial message too large, dropped")
+                        RX_OVERFLOWS += 1
+                        rx_skip = rx_need - rx_len
+                        rx_need = 0
+                        rx_len = 0
+                        rx_start = pos % RX_BUFFER_SIZE
+                        continue
+                if rx_len == rx_need:
+                    serial_message(rx_message())
+                    rx_start = pos % RX_BUFFER_SIZE
+                    rx_len = 0
+                    rx_need = 0
+                continue
+
+            newline = rx_buffer.find(b"\n", pos, end)
+            if newline < 0:
+                if rx_discard:
+                    rx_start = end % RX_BUFFER_SIZE
+                else:
+                    rx_len += end - pos
+                break
+            rx_len += newline - pos
+            if rx_discard:
+                rx_discard = False
+            elif rx_len:
+                serial_message(rx_message())
+            rx_start = (newline + 1) % RX_BUFFER_SIZE
+            rx_len = 0
+            pos = newline + 1
+
+
+def rx_message():
+    end = rx_start + rx_len
+    if end <= RX_BUFFER_SIZE:
+        return bytes(rx_view[rx_start:end])
+    ## Message wraps around the end of the ring
+    return bytes(rx_view[rx_start:]) + bytes(rx_view[:end - RX_BUFFER_SIZE])
+
+
+def serial_message(data):
+    if data.startswith(b"STATS"):
+        stats_command(data[6:].decode().strip())
+        return
+    if data.startswith(b"TYPE "):
+        try:
+            type_text(json.loads(data[5:].decode()))
+        except Exception as e:
+            print(f"Could not type {data}")
+        return
+
+    start = stat_start()
+    try:
+        if data[0] == WIRE_MAGIC:
+            load_wire(data)
+        elif data[0] == WIRE_DELTA_MAGIC:
+            load_delta(data)
+        elif data.startswith(b"ACTIVATE "):
+            activate_cached(int(data[9:].decode(), 16))
+        elif data.startswith(b"STORE "):
+            profile_id, name = data[6:].decode().split(" ", 1)
+            store_put(int(profile_id, 16), name)
+        elif data.startswith(b"LOAD "):
+            activate_stored(data[5:].decode())
+        else:
+            load_config(json.loads(data.decode()))
+    except Exception as e:
+        print(f"Could not get config from serial {data}")
+    stat_end(STAT_LOAD, start)
+
+
+# === Tick Helpers (supervisor.ticks_ms wraps around every 2**29 ms) ===
+TICKS_PERIOD = 1 << 29
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & TICKS_MAX
+    return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+
+# === Latency Instrumentation ===
+## Durations in microseconds, kept in preallocated arrays per slot and sent
+## to the host on a STATS request. Each request starts a new window
+STAT_SCAN = 0       # One matrix scan
+STAT_KEY = 1        # Acting on one key event
+STAT_HID = 2        # One macro op, the HID reports it sends
+STAT_LOAD = 3       # Loading or switching a profile from the host
+STAT_WAKE = 4       # From noticing the host awake to the end of the first scan
+STAT_WAIT = 5       # The low power wait GP0 went high in, at most SLEEP_POLL_MS when polling
+STAT_SELF = 6       # Scratch slot for measuring the instrumentation, not reported
+STAT_NAMES = ("scan", "key", "hid", "load", "wake", "wait")
+STAT_SLOTS = len(STAT_NAMES) + 1
+
+stat_count = array.array("L", [0] * STAT_SLOTS)
+stat_total = array.array("L", [0] * STAT_SLOTS)
+stat_min = array.array("L", [0] * STAT_SLOTS)
+stat_max = array.array("L", [0] * STAT_SLOTS)
+stat_hist = array.array("L", [0] * (STAT_SLOTS * STATS_BUCKETS))
+
+
+def stat_start():
+    return time.monotonic_ns() if STATS_ENABLED else 0
+
+
+def stat_end(slot, start):
+    if not STATS_ENABLED or not start:
+        return
+    us = (time.monotonic_ns() - start) // 1000
+    count = stat_count[slot]
+    if not count or us < stat_min[slot]:
+        stat_min[slot] = us
+    if us > stat_max[slot]:
+        stat_max[slot] = us
+    stat_count[slot] = count + 1
+    stat_total[slot] += us
+    bucket = 0
+    while us >> bucket and bucket < STATS_BUCKETS - 1:
+        bucket += 1
+    stat_hist[slot * STATS_BUCKETS + bucket] += 1
+
+
+def stats_reset():
+    for slot in range(STAT_SLOTS):
+        stat_count[slot] = 0
+        stat_total[slot] = 0
+        stat_min[slot] = 0
+        stat_max[slot] = 0
+    for i in range(len(stat_hist)):
+        stat_hist[i] = 0
+
+
+def stats_overhead():
+    ## Cost of one sample in ns and in heap bytes, zero-ish when the instrumentation is off.
+    ## A collection during the samples reads as no allocation
+    start = time.monotonic_ns()
+    free = gc.mem_free()
+    for _ in range(STATS_CALIBRATE):
+        stat_end(STAT_SELF, stat_start())
+    used = free - gc.mem_free()
+    elapsed = time.monotonic_ns() - start
+    return elapsed // STATS_CALIBRATE, max(used, 0) // STATS_CALIBRATE
+
+
+def stats_report():
+    overhead_ns, overhead_bytes = stats_overhead()
+    report = {
+        "enabled": STATS_ENABLED,
+        "overhead_ns": overhead_ns,
+        "overhead_bytes": overhead_bytes,
+        "scan_rate": SCAN_RATE,
+        "scan_latency_max": SCAN_LATENCY_MAX,
+        "event_latency_max": EVENT_LATENCY_MAX,
+        "event_overflows": EVENT_OVERFLOWS,
+        "event_queue_peak": EVENT_QUEUE_PEAK,
+        "rx_overflows": RX_OVERFLOWS,
+        "avoided_transactions": is31.avoided_transactions,
+        "mem_free": gc.mem_free(),
+    }
+    for slot, name in enumerate(STAT_NAMES):
+        count = stat_count[slot]
+        report[name] = {
+            "n": count,
+            "min": stat_min[slot],
+            "avg": stat_total[slot] // count if count else 0,
+            "max": stat_max[slot],
+            "hist": list(stat_hist[slot * STATS_BUCKETS:(slot + 1) * STATS_BUCKETS]),
+        }
+    return report
+
+
+def stats_command(arg):
+    global STATS_ENABLED
+    if arg == "ON":
+        STATS_ENABLED = True
+    elif arg == "OFF":
+        STATS_ENABLED = False
+    usb_serial.write((json.dumps({"stats": stats_report()}) + '\n').encode())
+    usb_serial.flush()
+    stats_reset()
+
+
+# === Adaptive Scan Scheduling ===
+scan_active_until = 0   # Tick until which scanning runs without pause
+scan_last = None        # Tick of the previous scan, None after a pause
+scan_count = 0
+scan_window = 0
+scan_gap_max = 0
+
+# Results of the last completed stats window
+SCAN_RATE = 0           # Scans per second
+SCAN_LATENCY_MAX = 0    # Worst case press detection latency (ms), the longest gap between scans
+
+
+def scan_done(now):
+    global scan_active_until, scan_last, scan_count, scan_window, scan_gap_max
+    global SCAN_RATE, SCAN_LATENCY_MAX, EVENT_LATENCY_MAX, event_lag_max
+
+    if scan_state or event_len or macro_busy():
+        scan_active_until = ticks_add(now, SCAN_ACTIVE_HOLD_MS)
+
+    if scan_last is None:
+        scan_count = 0
+        scan_window = now
+        scan_gap_max = 0
+    else:
+        gap = ticks_diff(now, scan_last)
+        if gap > scan_gap_max:
+            scan_gap_max = gap
+    scan_last = now
+    scan_count += 1
+
+    elapsed = ticks_diff(now, scan_window)
+    if elapsed >= STATS_WINDOW_MS:
+        SCAN_RATE = scan_count * 1000 // elapsed
+        SCAN_LATENCY_MAX = scan_gap_max
+        EVENT_LATENCY_MAX = event_lag_max
+        event_lag_max = 0
+        DEBUG and print(
+            f"Scan rate {SCAN_RATE}/s, worst latency {SCAN_LATENCY_MAX} ms, "
+            f"event wait {EVENT_LATENCY_MAX} ms, {EVENT_OVERFLOWS} deferred"
+        )
+        scan_count = 0
+        scan_window = now
+        scan_gap_max = 0
+
+
+def scan_pause(now):
+    ## Keys in use are scanned flat out, otherwise fall back to the idle rate
+    if ticks_diff(scan_active_until, now) > 0:
+        return
+    time.sleep(SCAN_IDLE_MS / 1000)
 
 
 # === Main Execution Loop ===
 print ("Starting up")
+
+## Restore the default profile saved by the host, without waiting for it
+try:
+    store_open()
+    activate_stored("default")
+except Exception as e:
+    print(f"Could not restore stored profile: {e}")
+
 while True:
 
     ## Reset output pins
@@ -306,11 +1361,14 @@ while True:
 
     try:
         usb_serial = usb_cdc.data
+        usb_serial.timeout = 0  # Reads return whatever is available
         usb_serial.flush()
     except Exception as e:
         usb_serial = None
         print(f"Error: {e}")
         
+    serial_due = supervisor.ticks_ms()
+    wake_start = 0
     while True:
         try:
 
@@ -319,25 +1377,46 @@ while True:
 
 # Input pin used to detect host sleep state
             if sleep_pin.value:
-                time.sleep(0.01)
-                if usb_serial and usb_serial.in_waiting:
-                    try:
-                        data = usb_serial.readline(-1).decode()
-                        load_config(json.loads(data))
-                    except Exception as e:
-                        print(f"Could not get config from serial {data}")
+                now = supervisor.ticks_ms()
+                if ticks_diff(now, serial_due) >= 0:
+                    serial_due = ticks_add(now, SERIAL_POLL_MS)
+                    if usb_serial:
+                        serial_receive()
+                start = stat_start()
                 try:
                     matrix_scan()
                 except Exception as e:
                     print(f"Error: {e}")
+                stat_end(STAT_SCAN, start)
+                if wake_start:
+                    stat_end(STAT_WAKE, wake_start)
+                    wake_start = 0
+                try:
+                    events_run(supervisor.ticks_ms())
+                except Exception as e:
+                    print(f"Error: {e}")
+                macro_step(supervisor.ticks_ms())
+                scan_done(now)
+                scan_pause(now)
             else:
-                ## Sleep mode. will not scan for 5 more seconds
-                time.sleep(5)
+                ## Sleep mode. Wait in low power until the host wakes up
+                if macro_busy():
+                    macro_cancel()
+                    keyboard.release_all()
+                scan_last = None
+                wait_start = stat_start()
+                sleep_wait()
+                if sleep_pin.value:
+                    ## The host woke up at some point during the wait
+                    stat_end(STAT_WAIT, wait_start)
+                    wake_start = stat_start()
 
         except Exception as e:
             print(f"Error: {e}")
             traceback.print_exc()
+            macro_cancel()
             keyboard.release_all()
             print ("Will pause for 5 seconds and retry")
+            scan_last = None
             time.sleep(5)
 
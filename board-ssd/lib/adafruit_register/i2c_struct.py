@@ -64,26 +64,42 @@ class UnaryStruct:
 
     :param int register_address: The register address to read the bit from
     :param str struct_format: The struct format string for this register.
+    :param bool preallocate: Keep one buffer for every access instead of allocating
+      a new one each time. The buffer is shared by all instances of the owning
+      class, so this is only safe for single-threaded code. Defaults to False.
     """
 
-    def __init__(self, register_address: int, struct_format: str) -> None:
+    def __init__(
+        self, register_address: int, struct_format: str, preallocate: bool = False
+    ) -> None:
         self.format = struct_format
         self.address = register_address
+        self.size = struct.calcsize(struct_format)
+        self.buffer = None
+        if preallocate:
+            self.buffer = bytearray(1 + self.size)
+            self.buffer[0] = register_address
+
+    def _get_buffer(self) -> bytearray:
+        """Shared or freshly created buffer, with the register address in place."""
+        if self.buffer:
+            return self.buffer
+        buf = bytearray(1 + self.size)
+        buf[0] = self.address
+        return buf
 
     def __get__(
         self,
         obj: Optional[I2CDeviceDriver],
         objtype: Optional[Type[I2CDeviceDriver]] = None,
     ) -> Any:
-        buf = bytearray(1 + struct.calcsize(self.format))
-        buf[0] = self.address
+        buf = self._get_buffer()
         with obj.i2c_device as i2c:
             i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
         return struct.unpack_from(self.format, buf, 1)[0]
 
     def __set__(self, obj: I2CDeviceDriver, value: Any) -> None:
-        buf = bytearray(1 + struct.calcsize(self.format))
-        buf[0] = self.address
+        buf = self._get_buffer()
         struct.pack_into(self.format, buf, 1, value)
         with obj.i2c_device as i2c:
             i2c.write(buf)
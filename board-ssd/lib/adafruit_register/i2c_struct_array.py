@@ -18,7 +18,7 @@ __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_Register.git"
 import struct
 
 try:
-    from typing import Tuple, Optional, Type
+    from typing import List, Sequence, Tuple, Optional, Type, Union
     from circuitpython_typing.device_drivers import I2CDeviceDriver
 except ImportError:
     pass
@@ -28,10 +28,14 @@ class _BoundStructArray:
     """
     Array object that `StructArray` constructs on demand.
 
+    Slices of contiguous elements (``arr[4:16]``) are read or written in a single
+    auto-increment I2C transaction.
+
     :param object obj: The device object to bind to. It must have a `i2c_device` attribute
     :param int register_address: The register address to read the bit from
     :param str struct_format: The struct format string for each register element
     :param int count: Number of elements in the array
+    :param bool preallocate: Reuse one buffer for every element access
     """
 
     def __init__(
@@ -40,30 +44,73 @@ class _BoundStructArray:
         register_address: int,
         struct_format: str,
         count: int,
+        preallocate: bool = False,
     ) -> None:
         self.format = struct_format
         self.first_register = register_address
         self.obj = obj
         self.count = count
+        self.size = struct.calcsize(struct_format)
+        self.preallocate = preallocate
+        self.buffer = bytearray(self.size + 1) if preallocate else None
+        self.burst_buffer = None
 
     def _get_buffer(self, index: int) -> bytearray:
         """Shared bounds checking and buffer creation."""
         if not 0 <= index < self.count:
             raise IndexError()
-        size = struct.calcsize(self.format)
-        # We create the buffer every time instead of keeping the buffer (which is 32 bytes at least)
-        # around forever.
-        buf = bytearray(size + 1)
-        buf[0] = self.first_register + size * index
+        # Unless preallocated, we create the buffer every time instead of keeping the buffer
+        # (which is 32 bytes at least) around forever.
+        buf = self.buffer or bytearray(self.size + 1)
+        buf[0] = self.first_register + self.size * index
         return buf
 
-    def __getitem__(self, index: int) -> Tuple:
+    def _get_burst_buffer(self, index: slice) -> Tuple[bytearray, int, int]:
+        """Buffer for a contiguous slice, with the count of elements and bytes used."""
+        start, stop, step = index.indices(self.count)
+        if step != 1:
+            raise ValueError("Only contiguous slices are supported")
+        length = max(0, stop - start)
+        end = 1 + self.size * length
+        if self.preallocate:
+            # A single buffer big enough for the whole array serves every slice.
+            if self.burst_buffer is None:
+                self.burst_buffer = bytearray(1 + self.size * self.count)
+            buf = self.burst_buffer
+        else:
+            buf = bytearray(end)
+        buf[0] = self.first_register + self.size * start
+        return buf, length, end
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Tuple, List[Tuple]]:
+        if isinstance(index, slice):
+            buf, length, end = self._get_burst_buffer(index)
+            if length:
+                with self.obj.i2c_device as i2c:
+                    i2c.write_then_readinto(buf, buf, out_end=1, in_start=1, in_end=end)
+            return [
+                struct.unpack_from(self.format, buf, 1 + self.size * i)
+                for i in range(length)
+            ]
         buf = self._get_buffer(index)
         with self.obj.i2c_device as i2c:
             i2c.write_then_readinto(buf, buf, out_end=1, in_start=1)
         return struct.unpack_from(self.format, buf, 1)  # offset=1
 
-    def __setitem__(self, index: int, value: Tuple) -> None:
+    def __setitem__(
+        self, index: Union[int, slice], value: Union[Tuple, Sequence[Tuple]]
+    ) -> None:
+        if isinstance(index, slice):
+            buf, length, end = self._get_burst_buffer(index)
+            if len(value) != length:
+                raise ValueError("Slice assignment cannot change the array size")
+            if not length:
+                return
+            for i, item in enumerate(value):
+                struct.pack_into(self.format, buf, 1 + self.size * i, *item)
+            with self.obj.i2c_device as i2c:
+                i2c.write(buf, end=end)
+            return
         buf = self._get_buffer(index)
         struct.pack_into(self.format, buf, 1, *value)
         with self.obj.i2c_device as i2c:
@@ -88,12 +135,21 @@ class StructArray:
     :param int register_address: The register address to begin reading the array from
     :param str struct_format: The struct format string for this register.
     :param int count: Number of elements in the array
+    :param bool preallocate: Keep one buffer per bound array instead of allocating a new
+      one on every element access. Only safe for single-threaded code. Defaults to False.
     """
 
-    def __init__(self, register_address: int, struct_format: str, count: int) -> None:
+    def __init__(
+        self,
+        register_address: int,
+        struct_format: str,
+        count: int,
+        preallocate: bool = False,
+    ) -> None:
         self.format = struct_format
         self.address = register_address
         self.count = count
+        self.preallocate = preallocate
         self.array_id = "_structarray{}".format(register_address)
 
     def __get__(
@@ -109,6 +165,8 @@ class StructArray:
             setattr(
                 obj,
                 self.array_id,
-                _BoundStructArray(obj, self.address, self.format, self.count),
+                _BoundStructArray(
+                    obj, self.address, self.format, self.count, self.preallocate
+                ),
             )
         return getattr(obj, self.array_id)
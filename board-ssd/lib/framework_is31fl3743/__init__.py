@@ -28,7 +28,6 @@ Implementation Notes
 from sys import implementation
 from adafruit_bus_device import i2c_device
 from adafruit_register.i2c_struct import ROUnaryStruct, UnaryStruct
-from adafruit_register.i2c_bit import RWBit
 
 try:
     # Used only for typing
@@ -78,15 +77,18 @@ class IS31FL3743:
                      when show() is called, but fall back on NO_BUFFER
                      behavior. MUST_BUFFER = buffer pixels in RAM, throw
                      MemoryError if allocation fails.
+
+    The configuration, global current and scaling registers are shadowed in
+    RAM. Setting them to the value they already hold causes no I2C traffic,
+    and `avoided_transactions` counts the bus transactions saved that way.
     """
 
-    _page_reg = UnaryStruct(_IS3743_COMMANDREGISTER, "<B")
-    _lock_reg = UnaryStruct(_IS3743_COMMANDREGISTERLOCK, "<B")
-    _id_reg = UnaryStruct(_IS3743_IDREGISTER, "<B")
-    _config_reg = UnaryStruct(_IS3743_FUNCREG_CONFIG, "<B")
-    _gcurrent_reg = UnaryStruct(_IS3743_FUNCREG_GCURRENT, "<B")
-    _reset_reg = UnaryStruct(_IS3743_FUNCREG_RESET, "<B")
-    _shutdown_bit = RWBit(_IS3743_FUNCREG_CONFIG, 0)
+    _page_reg = UnaryStruct(_IS3743_COMMANDREGISTER, "<B", preallocate=True)
+    _lock_reg = UnaryStruct(_IS3743_COMMANDREGISTERLOCK, "<B", preallocate=True)
+    _id_reg = UnaryStruct(_IS3743_IDREGISTER, "<B", preallocate=True)
+    _config_reg = UnaryStruct(_IS3743_FUNCREG_CONFIG, "<B", preallocate=True)
+    _gcurrent_reg = UnaryStruct(_IS3743_FUNCREG_GCURRENT, "<B", preallocate=True)
+    _reset_reg = UnaryStruct(_IS3743_FUNCREG_RESET, "<B", preallocate=True)
     _pixel_buffer = None
 
     def __init__(
@@ -112,12 +114,23 @@ class IS31FL3743:
             )
         self._buf = bytearray(2)
         self._page = None
+        self.avoided_transactions = 0
         self.reset()
 
     def reset(self) -> None:
         """Reset"""
         self.page = 2
         self._reset_reg = 0xAE
+        # Shadow copies of the registers, None until known
+        self._config = None
+        self._gcurrent = None
+        self._scaling = None
+
+    def _avoid(self, page: int, count: int) -> None:
+        """Account for a register access answered by its shadow copy."""
+        if page != self._page:
+            count += 2  # unlock and page select
+        self.avoided_transactions += count
 
     def unlock(self) -> None:
         """Unlock"""
@@ -128,33 +141,74 @@ class IS31FL3743:
 
         :param scale: Scaling level from 0 (off) to 255 (brightest).
         """
+        if scale == self._scaling:
+            self._avoid(1, 1)
+            return
         scalebuf = bytearray([scale] * (NUM_LEDS + 1))  # LEDs + 1 for reg addr
         scalebuf[0] = 0  # Initial register address
         self.page = 1
         with self.i2c_device as i2c:
             i2c.write(scalebuf)
+        self._scaling = scale
 
     @property
     def global_current(self) -> int:
         """Global current"""
+        if self._gcurrent is not None:
+            self._avoid(2, 1)
+            return self._gcurrent
         self.page = 2
-        return self._gcurrent_reg
+        self._gcurrent = self._gcurrent_reg
+        return self._gcurrent
 
     @global_current.setter
     def global_current(self, current: int) -> None:
+        if current == self._gcurrent:
+            self._avoid(2, 1)
+            return
         self.page = 2
         self._gcurrent_reg = current
+        self._gcurrent = current
+
+    @property
+    def config(self) -> int:
+        """Configuration register"""
+        if self._config is not None:
+            self._avoid(2, 1)
+            return self._config
+        self.page = 2
+        self._config = self._config_reg
+        return self._config
+
+    @config.setter
+    def config(self, value: int) -> None:
+        if value == self._config:
+            self._avoid(2, 1)
+            return
+        self.page = 2
+        self._config_reg = value
+        self._config = value
 
     @property
     def enable(self) -> bool:
         """Enable"""
-        self.page = 2
-        return self._shutdown_bit
+        return bool(self.config & 0x01)
 
     @enable.setter
     def enable(self, enable: bool) -> None:
+        if self._config is None:
+            self.page = 2
+            self._config = self._config_reg
+        if enable:
+            value = self._config | 0x01
+        else:
+            value = self._config & ~0x01
+        if value == self._config:
+            self._avoid(2, 2)  # read and write of the shutdown bit
+            return
         self.page = 2
-        self._shutdown_bit = enable
+        self._config_reg = value
+        self._config = value
 
     @property
     def page(self) -> Union[int, None]:
@@ -205,15 +259,26 @@ class IS31FL3743:
         else:
             raise ValueError(f"LED must be 0 ~ {NUM_LEDS}")
 
-    def show(self) -> None:
+    def show(self, start: int = 0, end: int = NUM_LEDS) -> None:
         """Issue in-RAM pixel data to device. No effect if pixels are
         unbuffered.
+
+        :param start: First LED to send. Defaults to 0.
+        :param end: One past the last LED to send. Defaults to all LEDs.
         """
         if self._pixel_buffer:
             self.page = 0
-            with self.i2c_device as i2c:
-                # _pixel_buffer[0] is always 0! (First register addr)
-                i2c.write(self._pixel_buffer)
+            buf = self._pixel_buffer
+            # The byte just before the first LED is temporarily replaced
+            # by its register address, so any run can be written straight
+            # from the buffer. _pixel_buffer[0] is always 0 already.
+            saved = buf[start]
+            buf[start] = start
+            try:
+                with self.i2c_device as i2c:
+                    i2c.write(buf, start=start, end=end + 1)
+            finally:
+                buf[start] = saved
 
     def write(self, mapping: Tuple, buffer: ReadableBuffer) -> None:
         """
@@ -1,32 +1,76 @@
 import serial
 import time
-import pystray
-from pystray import MenuItem as item, Icon
-from PIL import Image
 import sys
 import threading
-import pygetwindow as gw
-import win32gui
-import win32con
-import win32process
+import queue
 import json
 import re
 from pathlib import Path
-import datetime
-import os
 import subprocess
-import keyboard
 
 import ctypes
 import psutil
 import uuid
+import struct
+import binascii
+from collections import OrderedDict
+
+# Solo en Windows. Sin ellas el daemon puede funcionar con un proveedor de ventanas simulado
+try:
+    import pygetwindow as gw
+    import win32gui
+    import win32con
+    import win32process
+except ImportError:
+    win32gui = None
+
+# El icono de la bandeja y la escritura desde el PC. Sin ellas el daemon se puede importar en las pruebas
+try:
+    import pystray
+    from pystray import MenuItem as item, Icon
+    from PIL import Image
+except ImportError:
+    pystray = None
+try:
+    import keyboard
+except ImportError:
+    keyboard = None
+
+# Keycodes HID de los nombres de adafruit_hid.keycode.Keycode, para precompilar las macros
+# sin depender de la librería de la placa
+KEYCODES = {
+    "A": 0x04, "B": 0x05, "C": 0x06, "D": 0x07, "E": 0x08, "F": 0x09, "G": 0x0A, "H": 0x0B,
+    "I": 0x0C, "J": 0x0D, "K": 0x0E, "L": 0x0F, "M": 0x10, "N": 0x11, "O": 0x12, "P": 0x13,
+    "Q": 0x14, "R": 0x15, "S": 0x16, "T": 0x17, "U": 0x18, "V": 0x19, "W": 0x1A, "X": 0x1B,
+    "Y": 0x1C, "Z": 0x1D, "ONE": 0x1E, "TWO": 0x1F, "THREE": 0x20, "FOUR": 0x21, "FIVE": 0x22,
+    "SIX": 0x23, "SEVEN": 0x24, "EIGHT": 0x25, "NINE": 0x26, "ZERO": 0x27, "ENTER": 0x28,
+    "RETURN": 0x28, "ESCAPE": 0x29, "BACKSPACE": 0x2A, "TAB": 0x2B, "SPACEBAR": 0x2C, "SPACE": 0x2C,
+    "MINUS": 0x2D, "EQUALS": 0x2E, "LEFT_BRACKET": 0x2F, "RIGHT_BRACKET": 0x30, "BACKSLASH": 0x31,
+    "POUND": 0x32, "SEMICOLON": 0x33, "QUOTE": 0x34, "GRAVE_ACCENT": 0x35, "COMMA": 0x36,
+    "PERIOD": 0x37, "FORWARD_SLASH": 0x38, "CAPS_LOCK": 0x39, "F1": 0x3A, "F2": 0x3B, "F3": 0x3C,
+    "F4": 0x3D, "F5": 0x3E, "F6": 0x3F, "F7": 0x40, "F8": 0x41, "F9": 0x42, "F10": 0x43,
+    "F11": 0x44, "F12": 0x45, "PRINT_SCREEN": 0x46, "SCROLL_LOCK": 0x47, "PAUSE": 0x48,
+    "INSERT": 0x49, "HOME": 0x4A, "PAGE_UP": 0x4B, "DELETE": 0x4C, "END": 0x4D, "PAGE_DOWN": 0x4E,
+    "RIGHT_ARROW": 0x4F, "LEFT_ARROW": 0x50, "DOWN_ARROW": 0x51, "UP_ARROW": 0x52,
+    "KEYPAD_NUMLOCK": 0x53, "KEYPAD_FORWARD_SLASH": 0x54, "KEYPAD_ASTERISK": 0x55,
+    "KEYPAD_MINUS": 0x56, "KEYPAD_PLUS": 0x57, "KEYPAD_ENTER": 0x58, "KEYPAD_ONE": 0x59,
+    "KEYPAD_TWO": 0x5A, "KEYPAD_THREE": 0x5B, "KEYPAD_FOUR": 0x5C, "KEYPAD_FIVE": 0x5D,
+    "KEYPAD_SIX": 0x5E, "KEYPAD_SEVEN": 0x5F, "KEYPAD_EIGHT": 0x60, "KEYPAD_NINE": 0x61,
+    "KEYPAD_ZERO": 0x62, "KEYPAD_PERIOD": 0x63, "KEYPAD_BACKSLASH": 0x64, "APPLICATION": 0x65,
+    "POWER": 0x66, "KEYPAD_EQUALS": 0x67, "F13": 0x68, "F14": 0x69, "F15": 0x6A, "F16": 0x6B,
+    "F17": 0x6C, "F18": 0x6D, "F19": 0x6E, "F20": 0x6F, "F21": 0x70, "F22": 0x71, "F23": 0x72,
+    "F24": 0x73, "LEFT_CONTROL": 0xE0, "CONTROL": 0xE0, "LEFT_SHIFT": 0xE1, "SHIFT": 0xE1,
+    "LEFT_ALT": 0xE2, "ALT": 0xE2, "OPTION": 0xE2, "LEFT_GUI": 0xE3, "GUI": 0xE3, "WINDOWS": 0xE3,
+    "COMMAND": 0xE3, "RIGHT_CONTROL": 0xE4, "RIGHT_SHIFT": 0xE5, "RIGHT_ALT": 0xE6,
+    "RIGHT_GUI": 0xE7,
+}
 
 latest_window = ''
 latest_uuid = None
 
 
-# Cambiar al directorio donde está el script
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+# Directorio del script, donde están config.json y el icono
+SCRIPT_DIR = Path(__file__).resolve().parent
 
 # Configurar el puerto COM4
 ser = None
@@ -43,6 +87,75 @@ programs={
 
 configs={}
 
+# config.json lo vigila un hilo aparte, que lo recompila y cambia de una vez cuando se guarda
+CONFIG_PATH = SCRIPT_DIR / "config.json"
+CONFIG_DEBOUNCE_SECONDS = 0.3   # Tiempo sin cambios antes de leer el fichero
+CONFIG_POLL_SECONDS = 1         # Comprobación periódica, la única si no hay avisos de Windows
+
+# Enviar los perfiles en formato binario. Si no, o si no se pueden compilar, se envía JSON
+USE_BINARY = True
+
+# Formato binario de perfiles, debe coincidir con code.py
+WIRE_MAGIC = 0xA5
+WIRE_DELTA_MAGIC = 0xA6
+WIRE_VERSION = 1
+WIRE_MACRO = 0
+WIRE_MESSAGE = 1
+WIRE_KEYS = [
+    "a1", "a2", "a3", "a4", "b1", "b2", "b3", "b4", "c1", "c2", "c3", "c4",
+    "d1", "d2", "d3", "d4", "e1", "e2", "e3", "e4", "f1", "f2", "f3", "f4"
+]
+CHORD_MAX_KEYS = 4
+
+# Perfiles binarios enviados, por ID (CRC32 del cuerpo), y los que la placa puede tener en caché
+# o guardados. Se conservan al reconectar: si la placa ya no tiene uno, responde MISS y se reenvía
+profile_frames = {}
+device_profiles = set()
+current_profile = None
+
+# Reenvíos seguidos de cada perfil desde el último cambio de perfil. Una placa que nunca lo acepta,
+# por ejemplo con otra versión del formato, no debe recibirlo en bucle
+PROFILE_RESEND_MAX = 3
+profile_resends = {}
+
+# Perfil activo en la placa, base de las actualizaciones delta, y número de secuencia de la última
+# enviada. Solo cuentan los deltas que se envían: la placa espera siempre el siguiente
+device_config = None
+delta_seq = 0
+
+# Perfil que la placa tiene guardado con cada nombre. Cada perfil se guarda una vez, al enviarlo,
+# con su ID como nombre, y el base también como "default", el que restaura al arrancar. Así conserva
+# todos al apagarla, y solo escribe en su flash con los perfiles nuevos
+stored_names = {}
+
+# Escribir el texto de MSG:TYPE desde la placa, a la velocidad de los informes HID
+DEVICE_TYPING = True
+
+# Perfiles ya compuestos y codificados por ventana, del usado hace más tiempo al más reciente.
+# Se vacía al cambiar la versión de config.json
+PROFILE_CACHE_SIZE = 64
+resolved_profiles = OrderedDict()
+resolved_version = None
+profile_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Espera máxima por un cambio de ventana antes de volver a mirar el puerto serie
+SERIAL_CHECK_SECONDS = 0.05
+# Periodo de consulta de la ventana activa cuando no se pueden recibir eventos de Windows
+WINDOW_POLL_SECONDS = 0.5
+
+# Cada cuánto se piden a la placa sus estadísticas de latencia. 0 para no pedirlas
+STATS_POLL_SECONDS = 60
+# Pedir también los tiempos (STATS ON). La placa no los toma si no, porque cada medida reserva memoria
+STATS_TIMING = False
+
+# Operaciones de macro compiladas, dos bytes cada una: código y argumento
+OP_PRESS = 0
+OP_RELEASE = 1
+OP_TAP = 2
+OP_DELAY = 3
+MACRO_PAUSE_MS = 150  # Pausa de \p por defecto. Cada perfil puede fijar la suya con "pause_ms"
+SYMBOL_TABLE_SIZE = 128  # Caracteres con tecla en las tablas de símbolos
+
 def obtener_layout_actual():
     # Obtiene el ID del thread con foco (ventana activa)
     hWnd = ctypes.windll.user32.GetForegroundWindow()
@@ -96,7 +209,7 @@ def open_window(filtro_regex):
 def get_active_window():
     window = win32gui.GetForegroundWindow()
     if not window:
-        return 'None'
+        return None,None
 
     window_title = win32gui.GetWindowText(window)
     _, pid = win32process.GetWindowThreadProcessId(window)
@@ -108,38 +221,315 @@ def get_active_window():
         return None,None
     return exe,window_title
 
-def lookup_config(window_title):
-    global configs
+# Proveedores de la ventana activa. next_window(timeout) devuelve (programa, título, instante del cambio)
+# en cuanto cambia la ventana en primer plano, o None si no ha cambiado en ese tiempo
+class PollingWindowProvider:
+    """Consulta la ventana activa cada cierto tiempo. Alternativa si no se pueden recibir eventos"""
+
+    def __init__(self, interval=WINDOW_POLL_SECONDS):
+        self.interval = interval
+        self.next_poll = time.monotonic()
+        self.current = None
+
+    def next_window(self, timeout):
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return None
+        if wait > 0:
+            time.sleep(wait)
+        self.next_poll = time.monotonic() + self.interval
+        try:
+            window = get_active_window()
+        except Exception as ex:
+            print (f"Could not get active program")
+            return None
+        if window == self.current:
+            return None
+        self.current = window
+        return window + (time.perf_counter(),)
+
+class WinEventWindowProvider:
+    """Recibe de Windows los cambios de ventana en primer plano y de su título, sin consultar"""
+    EVENT_SYSTEM_FOREGROUND = 0x0003
+    EVENT_OBJECT_NAMECHANGE = 0x800C
+    WINEVENT_OUTOFCONTEXT = 0x0000
+    WINEVENT_SKIPOWNPROCESS = 0x0002
+    OBJID_WINDOW = 0
+
+    def __init__(self):
+        self.changes = queue.Queue()
+        self.current = None
+        self.error = None
+        self.ready = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        # La ventana que ya está activa cuenta como el primer cambio
+        self.changes.put(time.perf_counter())
+
+    def _run(self):
+        # Los ganchos se reciben en el bucle de mensajes del hilo que los instala
+        import ctypes.wintypes
+        user32 = ctypes.windll.user32
+        self.foreground = user32.GetForegroundWindow
+        WinEventProc = ctypes.WINFUNCTYPE(
+            None, ctypes.wintypes.HANDLE, ctypes.wintypes.DWORD, ctypes.wintypes.HWND,
+            ctypes.wintypes.LONG, ctypes.wintypes.LONG, ctypes.wintypes.DWORD, ctypes.wintypes.DWORD
+        )
+        self.callback = WinEventProc(self._on_event)  # Debe seguir referenciado mientras dure el gancho
+        try:
+            for event in (self.EVENT_SYSTEM_FOREGROUND, self.EVENT_OBJECT_NAMECHANGE):
+                if not user32.SetWinEventHook(
+                    event, event, 0, self.callback, 0, 0,
+                    self.WINEVENT_OUTOFCONTEXT | self.WINEVENT_SKIPOWNPROCESS
+                ):
+                    raise OSError(f"SetWinEventHook failed for event {event:#x}")
+        except Exception as ex:
+            self.error = ex
+            self.ready.set()
+            return
+        self.ready.set()
+
+        msg = ctypes.wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+
+    def _on_event(self, hook, event, hwnd, id_object, id_child, thread, event_time):
+        if id_object != self.OBJID_WINDOW or not hwnd:
+            return
+        # Los cambios de título solo interesan en la ventana activa (pestañas de chrome, msrdc)
+        if event == self.EVENT_OBJECT_NAMECHANGE and hwnd != self.foreground():
+            return
+        self.changes.put(time.perf_counter())
+
+    def next_window(self, timeout):
+        try:
+            changed_at = self.changes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        # Una ráfaga de eventos se resuelve una sola vez, contando desde el primero
+        while not self.changes.empty():
+            self.changes.get_nowait()
+        try:
+            window = get_active_window()
+        except Exception as ex:
+            print (f"Could not get active program")
+            return None
+        if window == self.current:
+            return None
+        self.current = window
+        return window + (changed_at,)
+
+class ScriptedWindowProvider:
+    """Ventanas simuladas para probar el daemon sin Windows: lista de (segundos de espera, programa, título)"""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.due = None
+
+    def next_window(self, timeout):
+        if not self.steps:
+            time.sleep(timeout)
+            return None
+        delay, program, title = self.steps[0]
+        if self.due is None:
+            self.due = time.perf_counter() + delay
+        wait = self.due - time.perf_counter()
+        if wait > timeout:
+            time.sleep(timeout)
+            return None
+        if wait > 0:
+            time.sleep(wait)
+        self.steps.pop(0)
+        changed_at, self.due = self.due, None
+        return program, title, changed_at
+
+def window_provider():
+    """Eventos de Windows si es posible, si no consulta periódica"""
+    if win32gui:
+        try:
+            return WinEventWindowProvider()
+        except Exception as ex:
+            print(f"Could not hook window events ({ex}), polling instead")
+    return PollingWindowProvider()
+
+def merge_profile(new_config, clave, profile):
+    """Aplica un perfil de config.json sobre la configuración compuesta"""
+    if not new_config['window']:
+        new_config['window'] = clave
+    new_config['keys'].update(profile['keys'])
+    new_config['colors'].update(profile['colors'])
+    if profile.get('symbols',None):
+        new_config['symbols'] = profile['symbols']
+    if profile.get('layout',None):
+        new_config['layout'] = profile['layout']
+    if profile.get('pause_ms',None) is not None:
+        new_config['pause_ms'] = profile['pause_ms']
+
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+
+def literal_alternatives(source):
+    """Alternativas de una clave del tipo 'outlook|mail' en minúsculas, o None si usa algo más que literales"""
+    alternatives = source.lower().split('|')
+    if not source.isascii() or any(not alt or REGEX_SPECIAL.intersection(alt) for alt in alternatives):
+        return None
+    return alternatives
+
+def combine_patterns(patterns):
+    """Une todas las claves en un solo buscador: un árbol de prefijos con los literales de las
+    claves, recorrido una vez sobre el título, más las claves que son expresiones de verdad.
+    Devuelve el árbol y los índices de las claves que hay que buscar por separado"""
+    trie = {}
+    others = []
+    for index, (_, pattern, _) in enumerate(patterns):
+        alternatives = literal_alternatives(pattern.pattern)
+        if alternatives is None:
+            others.append(index)
+            continue
+        for alternative in alternatives:
+            node = trie
+            for char in alternative:
+                node = node.setdefault(char, {})
+            # La clave None de un nodo guarda los perfiles cuyo literal acaba en él
+            node.setdefault(None, []).append(index)
+    return trie, others
+
+def match_profiles(configs, window_title):
+    """Índices, en orden de precedencia, de los perfiles cuya clave encaja con el título"""
+    trie, others = configs['matcher']
+    text = window_title.lower()
+    hits = set()
+    for start in range(len(text)):
+        node = trie
+        for position in range(start, len(text)):
+            node = node.get(text[position])
+            if node is None:
+                break
+            if None in node:
+                hits.update(node[None])
+    patterns = configs['patterns']
+    for index in others:
+        if patterns[index][1].search(window_title):
+            hits.add(index)
+    return sorted(hits)
+
+def compile_configs(raw, version):
+    """Índice de config.json: el perfil '.' ya aplicado como base y el resto de claves
+    compiladas, de menos a más específicas (las más largas mandan)"""
+    base = {
+        "window": None,
+        "colors": {},
+        "keys": {}
+    }
+    patterns = []
+    for clave in sorted(raw.keys(), key=len):
+        if clave == '.':
+            merge_profile(base, clave, raw[clave])
+            continue
+        try:
+            patterns.append((clave, re.compile(clave, re.IGNORECASE), raw[clave]))
+        except re.error as e:
+            print(f"Invalid profile key {clave}: {e}")
+    return {
+        "version": version,
+        "base": base,
+        "patterns": patterns,
+        "matcher": combine_patterns(patterns)
+    }
 
+def config_signature():
+    """Versión de config.json: cambia si cambia la fecha o el tamaño"""
+    try:
+        stat = CONFIG_PATH.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def reload_configs(signature=None):
+    """Lee y compila config.json y cambia de una vez el índice en uso.
+    signature es la que ha visto watch_configs, o se toma ahora si no se da.
+    Si no se puede leer, por ejemplo a medio guardar, se mantiene el anterior"""
+    global configs
     try:
-        config_version = datetime.datetime.fromtimestamp(Path("./config.json").stat().st_mtime)
-
-        if not configs or config_version > configs['version']:
-            with open("./config.json", 'r') as file:
-                configs = json.load(file)
-                configs['version'] = config_version
-
-        claves_ordenadas = sorted(configs.keys(), key=len, reverse=False)
-
-        new_config = {
-            "window": None,
-            "colors": {},
-            "keys": {}  
-        }
-        for clave in claves_ordenadas:
-            #print (f"Procesando {clave} para {window_title}")
-            if re.search(clave, window_title,re.IGNORECASE) or clave=='.':
-                print(f"{clave} matched for {window_title}")  
-                if not new_config['window']:
-                    new_config['window'] = clave
-                for key, value in configs[clave]['keys'].items():
-                    new_config['keys'][key]=value
-                for key, value in configs[clave]['colors'].items():
-                    new_config['colors'][key]=value
-                if (configs[clave]).get('symbols',None):
-                    new_config['symbols'] = configs[clave]['symbols'] 
-                if (configs[clave]).get('layout',None):
-                    new_config['layout']=configs[clave]['layout']
+        config_version = signature or config_signature()
+        if configs and config_version == configs['version']:
+            return False
+        with open(CONFIG_PATH, 'r') as file:
+            new_configs = compile_configs(json.load(file), config_version)
+    except Exception as e:
+        print(f"Error loading json: {e}")
+        return False
+    configs = new_configs
+    print(f"Configuration loaded from {CONFIG_PATH}")
+    return True
+
+def config_change_waiter():
+    """Función que espera un aviso de Windows de cambios en la carpeta de config.json.
+    Sin avisos nativos, simplemente espera CONFIG_POLL_SECONDS"""
+    try:
+        import win32file
+        import win32event
+        handle = win32file.FindFirstChangeNotification(
+            str(CONFIG_PATH.resolve().parent), False,
+            win32con.FILE_NOTIFY_CHANGE_LAST_WRITE | win32con.FILE_NOTIFY_CHANGE_SIZE | win32con.FILE_NOTIFY_CHANGE_FILE_NAME
+        )
+    except Exception as ex:
+        print(f"Could not watch {CONFIG_PATH} ({ex}), polling instead")
+        return lambda: time.sleep(CONFIG_POLL_SECONDS)
+
+    def wait():
+        # Con tope de tiempo, por si se pierde algún aviso
+        win32event.WaitForSingleObject(handle, int(CONFIG_POLL_SECONDS * 1000))
+        win32file.FindNextChangeNotification(handle)
+    return wait
+
+def watch_configs():
+    """Hilo que recarga config.json cuando cambia, fuera del camino del cambio de ventana"""
+    wait = config_change_waiter()
+    signature = config_signature()
+    while True:
+        wait()
+        changed = config_signature()
+        if changed == signature:
+            continue
+        # Los editores guardan en varios pasos: se espera a que el fichero deje de cambiar
+        while True:
+            time.sleep(CONFIG_DEBOUNCE_SECONDS)
+            settled = config_signature()
+            if settled == changed:
+                break
+            changed = settled
+        signature = changed
+        reload_configs(signature)
+
+def start_config_watcher():
+    """Carga config.json y deja un hilo vigilándolo"""
+    reload_configs()
+    threading.Thread(target=watch_configs, daemon=True).start()
+
+def load_configs():
+    """Índice de config.json en uso. Lo mantiene watch_configs, aquí no se toca el disco"""
+    if not configs:
+        raise ValueError(f"{CONFIG_PATH} is not loaded")
+    return configs
+
+def lookup_config(window_title, configs=None):
+    try:
+        configs = configs or load_configs()
+
+        base = configs['base']
+        new_config = dict(base)
+        new_config['colors'] = dict(base['colors'])
+        new_config['keys'] = dict(base['keys'])
+        matched = ['.'] if base['window'] else []
+        for index in match_profiles(configs, window_title):
+            clave, _, profile = configs['patterns'][index]
+            matched.append(clave)
+            merge_profile(new_config, clave, profile)
+        print(f"{', '.join(matched)} matched for {window_title}")
         # prettyprint new_config
         #print (f"Configuración compuesta: {new_config}") # en prettyprint
 
@@ -154,7 +544,256 @@ def lookup_config(window_title):
         "keys": {}
     }
 
-def type_chars(cadena):
+def symbol_tables(symbols):
+    """Tablas de keycodes por código de carácter, como load_symbols en la placa: teclas y escapes con \\"""
+    keys = bytearray(SYMBOL_TABLE_SIZE)
+    escapes = bytearray(SYMBOL_TABLE_SIZE)
+    for key, symbol in symbols.items():
+        table = keys
+        if len(key) == 2 and key[0] == '\\':
+            table = escapes
+            key = key[1]
+        key_code = KEYCODES.get(symbol)
+        if len(key) != 1 or ord(key) >= SYMBOL_TABLE_SIZE or key_code is None:
+            print(f"Could not find code for {key}")
+            continue
+        table[ord(key.upper())] = key_code
+        table[ord(key.lower())] = key_code
+    return keys, escapes
+
+def compile_macro(code, tables, pause_ms=MACRO_PAUSE_MS):
+    """Compila una macro a operaciones de teclado, igual que load_config en la placa"""
+    delay = min(pause_ms // 10, 255)  # La placa espera en unidades de 10 ms
+    press_ops = bytearray()
+    release_ops = bytearray()
+    keys, escapes = tables
+    escaped = False
+    for key in code:
+        table = keys
+        if escaped:
+            escaped = False
+            if key.upper() == 'P':
+                if delay:
+                    press_ops += bytes((OP_DELAY, delay))
+                    release_ops += bytes((OP_DELAY, delay))
+                continue
+            hold = key == key.upper()
+            table = escapes
+        elif key == '\\':
+            escaped = True
+            continue
+        else:
+            hold = False
+
+        key_code = table[ord(key)] if ord(key) < SYMBOL_TABLE_SIZE else 0
+        if not key_code:
+            print(f"Could not find code for {key}")
+            continue
+        if hold:
+            press_ops += bytes((OP_PRESS, key_code))
+        else:
+            press_ops += bytes((OP_TAP, key_code))
+            release_ops += bytes((OP_RELEASE, key_code))
+
+    return bytes(press_ops), bytes(release_ops)
+
+def chord_wire_mask(chord):
+    """Máscara de la combinación de teclas en el orden de WIRE_KEYS. None si no es válida"""
+    names = chord.split('-')
+    if len(names) > CHORD_MAX_KEYS or any(name not in WIRE_KEYS for name in names):
+        print(f"Invalid key combination {chord}")
+        return None
+    mask = 0
+    for name in names:
+        mask |= 1 << WIRE_KEYS.index(name)
+    return mask
+
+def color_bytes(value):
+    return int(value, 16).to_bytes(3, 'big') if value else bytes(3)
+
+def encode_entries(keys, symbols, pause_ms=MACRO_PAUSE_MS):
+    """Codifica las teclas, precedidas del número de entradas. None si son demasiadas"""
+    entries = bytearray()
+    count = 0
+    tables = symbol_tables(symbols)
+    for chord, code in keys.items():
+        mask = chord_wire_mask(chord)
+        if not code or mask is None:
+            continue
+        if code[:4] == 'MSG:':
+            text = code[4:].encode('utf-8')
+            entries += struct.pack('<IBH', mask, WIRE_MESSAGE, len(text)) + text
+        else:
+            press_ops, release_ops = compile_macro(code, tables, pause_ms)
+            entries += struct.pack('<IBH', mask, WIRE_MACRO, len(press_ops)) + press_ops
+            entries += struct.pack('<H', len(release_ops)) + release_ops
+        count += 1
+
+    if count > 255:
+        return None
+    return bytes((count,)) + bytes(entries)
+
+def wire_frame(magic, body):
+    return (
+        struct.pack('<BBH', magic, WIRE_VERSION, len(body))
+        + bytes(body)
+        + struct.pack('<I', binascii.crc32(body))
+    )
+
+def encode_profile(config):
+    """Codifica el perfil en el formato binario de la placa. None si no es posible"""
+    symbols = config.get('symbols')
+    if not USE_BINARY:
+        return None
+    if not symbols:
+        print("Profile has no symbols, sending it as JSON")
+        return None
+
+    body = bytearray()
+    for key in WIRE_KEYS:
+        body += color_bytes(config['colors'].get(key))
+
+    entries = encode_entries(config['keys'], symbols, config.get('pause_ms', MACRO_PAUSE_MS))
+    if entries is None:
+        return None
+    return wire_frame(WIRE_MAGIC, body + entries)
+
+def encode_delta(old, new, base_id, profile_id, seq):
+    """Codifica solo las diferencias entre dos perfiles. None si no es posible"""
+    if old.get('symbols') != new.get('symbols') or old.get('pause_ms') != new.get('pause_ms'):
+        return None
+
+    colors = bytearray()
+    count = 0
+    for index, key in enumerate(WIRE_KEYS):
+        value = color_bytes(new['colors'].get(key))
+        if value != color_bytes(old['colors'].get(key)):
+            colors += bytes((index,)) + value
+            count += 1
+    body = struct.pack('<HIIB', seq, base_id, profile_id, count) + colors
+
+    removed = [
+        chord_wire_mask(chord)
+        for chord, code in old['keys'].items()
+        if code and not new['keys'].get(chord)
+    ]
+    removed = [mask for mask in removed if mask is not None]
+    changed = {
+        chord: code
+        for chord, code in new['keys'].items()
+        if code and old['keys'].get(chord) != code
+    }
+    entries = encode_entries(changed, new['symbols'], new.get('pause_ms', MACRO_PAUSE_MS))
+    if len(removed) > 255 or entries is None:
+        return None
+    body += bytes((len(removed),)) + b''.join(struct.pack('<I', mask) for mask in removed)
+    return wire_frame(WIRE_DELTA_MAGIC, body + entries)
+
+def encode_payload(config):
+    """Lo que se envía a la placa para el perfil: la trama binaria o, si no se puede, la línea JSON"""
+    frame = encode_profile(config)
+    if frame is None:
+        return (json.dumps(config) + '\n').encode()
+    return frame
+
+def window_key(program):
+    """Identidad de la ventana para la caché. Las claves no distinguen mayúsculas"""
+    return program.strip().lower()
+
+def resolve_profile(program):
+    """Configuración compuesta y carga codificada de la ventana. Las ventanas ya vistas con la
+    misma versión de config.json salen de la caché, sin componer ni codificar de nuevo"""
+    global resolved_version
+    try:
+        index = load_configs()
+    except Exception:
+        config = lookup_config(program)
+        return config, encode_payload(config)
+
+    version = index['version']
+
+    if version != resolved_version:
+        resolved_profiles.clear()
+        resolved_version = version
+
+    key = window_key(program)
+    entry = resolved_profiles.get(key)
+    if entry:
+        resolved_profiles.move_to_end(key)
+        profile_cache_stats['hits'] += 1
+        return entry
+
+    profile_cache_stats['misses'] += 1
+    config = lookup_config(program, index)
+    entry = (config, encode_payload(config))
+    resolved_profiles[key] = entry
+    if len(resolved_profiles) > PROFILE_CACHE_SIZE:
+        resolved_profiles.popitem(last=False)
+        profile_cache_stats['evictions'] += 1
+    return entry
+
+def store_profile(profile_id, name):
+    """La placa guarda el perfil en su flash con ese nombre, si no lo tenía ya"""
+    if stored_names.get(name) != profile_id:
+        ser.write(f"STORE {profile_id:08x} {name}\n".encode())
+        stored_names[name] = profile_id
+
+def send_profile(config, payload, name=None):
+    """Envía el perfil a la placa: su ID si ya lo tiene en caché, si no las diferencias o el perfil completo,
+    que la placa guarda con su ID. Si se da un nombre, lo guarda también con él para restaurarlo al arrancar"""
+    global current_profile
+    global device_config
+    global delta_seq
+    if payload[0] != WIRE_MAGIC:
+        current_profile = None
+        device_config = None
+        ser.write(payload)
+        return
+
+    frame = payload
+
+    profile_id = struct.unpack_from('<I', frame, len(frame) - 4)[0]
+    profile_frames[profile_id] = frame
+    profile_resends.clear()
+    if profile_id in device_profiles:
+        ser.write(f"ACTIVATE {profile_id:08x}\n".encode())
+    else:
+        delta = None
+        seq = (delta_seq + 1) & 0xFFFF
+        if device_config and current_profile is not None:
+            delta = encode_delta(device_config, config, current_profile, profile_id, seq)
+        if delta and len(delta) < len(frame):
+            ser.write(delta)
+            delta_seq = seq
+        else:
+            ser.write(frame)
+        device_profiles.add(profile_id)
+        store_profile(profile_id, f"{profile_id:08x}")
+    if name:
+        store_profile(profile_id, name)
+    current_profile = profile_id
+    device_config = config
+
+def resend_profile(profile_id):
+    """La placa no tiene el perfil o no está sincronizada: se le envía completo"""
+    device_profiles.discard(profile_id)
+    frame = profile_frames.get(profile_id)
+    # Si ya se ha cambiado a otro perfil, no hace falta
+    if frame and profile_id == current_profile:
+        resends = profile_resends.get(profile_id, 0)
+        if resends >= PROFILE_RESEND_MAX:
+            print(f"Board keeps rejecting profile {profile_id:08x}, not sending it again")
+            return
+        profile_resends[profile_id] = resends + 1
+        ser.write(frame)
+        device_profiles.add(profile_id)
+        # Un STORE que llegó antes que el perfil no se guardó: se repite, sin coste si ya estaba
+        for name, stored_id in stored_names.items():
+            if stored_id == profile_id:
+                ser.write(f"STORE {profile_id:08x} {name}\n".encode())
+
+def resolve_text(cadena):
+    """Sustituye #NEW_UUID# y #UUID# en el texto a escribir"""
     global latest_uuid
     if '#NEW_UUID#' in cadena:
         latest_uuid=str(uuid.uuid4())
@@ -164,39 +803,97 @@ def type_chars(cadena):
         if not latest_uuid:
             latest_uuid=str(uuid.uuid4())
         cadena = cadena.replace("#UUID#",latest_uuid)
+    return cadena
 
+def type_chars(cadena):
+    """Escribe el texto desde el PC, tecla a tecla. Alternativa a escribirlo en la placa"""
+    if keyboard is None:
+        print("Cannot type on the PC without the keyboard package")
+        return
     for char in cadena:
         keyboard.press_and_release(char)
 
+def device_can_type(cadena):
+    """La placa escribe con la distribución US: solo si es la del sistema y el texto es ASCII imprimible"""
+    if not DEVICE_TYPING or not cadena.isascii() or not cadena.isprintable():
+        return False
+    return obtener_layout_actual() == layouts["EN"]
+
+def type_text(cadena):
+    """Escribe el texto de un MSG:TYPE, en la placa si es posible"""
+    cadena = resolve_text(cadena)
+    if device_can_type(cadena):
+        ser.write(f"TYPE {json.dumps(cadena)}\n".encode())
+    else:
+        type_chars(cadena)
+
 # Función principal que monitorea el cambio de ventana 
-def monitor_window_focus():
-    global configs
+def log_stats(stats):
+    """Muestra las estadísticas de latencia de la placa, tiempos en microsegundos"""
+    timings = ", ".join(
+        f"{name} {stats[name]['min']}/{stats[name]['avg']}/{stats[name]['max']} ({stats[name]['n']})"
+        for name in ('scan', 'key', 'hid', 'load', 'wake', 'wait')
+        if name in stats
+    )
+    print(
+        f"Device stats: {timings} us min/avg/max; "
+        f"{stats.get('scan_rate')} scans/s, worst gap {stats.get('scan_latency_max')} ms, "
+        f"event wait {stats.get('event_latency_max')} ms, "
+        f"overflows {stats.get('event_overflows')} events/{stats.get('rx_overflows')} rx, "
+        f"{stats.get('avoided_transactions')} I2C writes avoided, "
+        f"{stats.get('mem_free')} bytes free, "
+        f"overhead {stats.get('overhead_ns')} ns and {stats.get('overhead_bytes')} bytes/sample"
+    )
+    print(
+        f"Profile cache: {profile_cache_stats['hits']} hits, {profile_cache_stats['misses']} misses, "
+        f"{profile_cache_stats['evictions']} evictions, {len(resolved_profiles)} windows"
+    )
+
+def monitor_window_focus(provider=None):
     global ser
+    global device_config
+    provider = provider or window_provider()
     while True:
-        configs = {}
+        stored_names.clear()
+        device_config = None
         if ser:
             ser.close()
             ser = None
         ser = serial.Serial('COM4', 115200, timeout=1)  # Asegúrate de que COM4 es el puerto correcto
         try:
+            # El perfil base, que la placa activa al arrancar sin esperar al daemon
+            send_profile(*resolve_profile(''), 'default')
             current_program = ''
+            stats_due = time.monotonic() + STATS_POLL_SECONDS
             while True:
+                if STATS_POLL_SECONDS and time.monotonic() >= stats_due:
+                    stats_due = time.monotonic() + STATS_POLL_SECONDS
+                    ser.write(b"STATS ON\n" if STATS_TIMING else b"STATS\n")
+
                 if ser.in_waiting:
                     data = json.loads(ser.readline().decode('utf-8').strip())
+                    if 'stats' in data:
+                        log_stats(data['stats'])
+                        continue
                     print(f"{data} received")
-                    if data['code'][:5]=='OPEN:':
-                        app = data['code'][5:]
+                    code = data.get('code', '')
+                    if code[:5]=='OPEN:':
+                        app = code[5:]
                         print(f"Told to open [{app}]")
                         open_window(app)
-                    if data['code'][:5]=='TYPE:':
-                        to_type = data['code'][5:]
+                    if code[:5]=='TYPE:':
+                        to_type = code[5:]
                         print(f"Told to type {to_type}")
-                        type_chars(to_type)
-
-                try:
-                    active_program, active_window = get_active_window()
-                except Exception as ex:
-                    print (f"Could not get active program")
+                        type_text(to_type)
+                    if code[:5]=='MISS:':
+                        resend_profile(int(code[5:], 16))
+                    if code[:7]=='RESYNC:':
+                        resend_profile(int(code[7:], 16))
+
+                window = provider.next_window(SERIAL_CHECK_SECONDS)
+                if not window:
+                    continue
+                active_program, active_window, changed_at = window
 
                 if not active_program:
                     continue
@@ -207,14 +904,12 @@ def monitor_window_focus():
 
                 if  active_program != current_program:
                     current_program = active_program
-                    active = lookup_config(active_program)
-                    command = json.dumps(active) + '\n'
-                    ser.write(command.encode())  # Enviar el comando al puerto (debe ser codificado en bytes)
+                    active, payload = resolve_profile(active_program)
+                    send_profile(active, payload)
+                    print(f"Profile for {active_program} sent {(time.perf_counter() - changed_at) * 1000:.1f} ms after the focus change")
                     if current_program!='explorer.exe' and active.get('layout'):
                         cambiar_layout(active['layout'],False)
 
-                time.sleep(0.5)  # Espera un poco antes de volver a comprobar
-
         except Exception as ex:
             print(f"Process failed {ex}")
         finally:
@@ -228,11 +923,12 @@ def salir(icon, item):
 
 # Cargar una imagen para el icono
 def crear_icono():
-    image = Image.open("icono.png")  # Reemplaza con tu icono
+    image = Image.open(SCRIPT_DIR / "icono.png")  # Reemplaza con tu icono
     menu = (item('Salir', salir),)
     icon = Icon("MiApp", image, menu=menu)
 
     # Iniciar el proceso en segundo plano
+    start_config_watcher()
     hilo = threading.Thread(target=monitor_window_focus, daemon=True)
     hilo.start()
 
@@ -0,0 +1,129 @@
+"""Run macro-daemon.py under test, with a fake serial port and keyboard.
+
+The daemon file name has a hyphen, so load() imports it from its path. The
+Windows only parts (window hooks, keyboard layout) are left out by the
+tests that need the daemon loop to run here.
+
+connected_pair() sets the daemon up with the fake pad from
+tests/board/fake_board.py, and deliver() carries messages between them.
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAEMON_PATH = os.path.join(HOST_DIR, "macro-daemon.py")
+
+sys.path.insert(0, os.path.join(os.path.dirname(HOST_DIR), "tests", "board"))
+import fake_board
+
+
+def load():
+    """Import macro-daemon.py as a fresh module, with config.json loaded."""
+    spec = importlib.util.spec_from_file_location("macro_daemon", DAEMON_PATH)
+    daemon = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(daemon)
+    daemon.reload_configs()
+    return daemon
+
+
+class FakeSerial:
+    """The daemon's end of the serial port. Records every write and when it happened."""
+
+    def __init__(self):
+        self.writes = []        # (time.perf_counter(), bytes)
+        self.rx = bytearray()   # Lines from the pad, waiting to be read
+        self.lock = threading.Lock()
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            return len(self.rx)
+
+    def readline(self):
+        with self.lock:
+            end = self.rx.find(b"\n") + 1 or len(self.rx)
+            line = bytes(self.rx[:end])
+            del self.rx[:end]
+            return line
+
+    def reply(self, line):
+        with self.lock:
+            self.rx += line + b"\n"
+
+    def write(self, data):
+        self.writes.append((time.perf_counter(), bytes(data)))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def profile_writes(self):
+        """The writes that change the pad's profile, without the STORE that follows a new one."""
+        return [write for write in self.writes if not write[1].startswith(b"STORE ")]
+
+    def wait_profile_writes(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        while len(self.profile_writes()) < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{len(self.profile_writes())} of {count} profile writes")
+            time.sleep(0.001)
+
+
+class FakeKeyboard:
+    """Stands in for the keyboard package. Records each key and when it was typed."""
+
+    def __init__(self):
+        self.typed = []     # (time.perf_counter(), key)
+
+    def press_and_release(self, key):
+        self.typed.append((time.perf_counter(), key))
+
+
+def connected_pair():
+    """A fake pad running code.py and a daemon writing to it through a FakeSerial."""
+    pad = fake_board.load()
+    daemon = load()
+    port = FakeSerial()
+    daemon.ser = port
+    return pad, daemon, port
+
+
+def deliver(pad, daemon, port, lost=()):
+    """Carry the daemon's writes to the pad, and its MISS: and RESYNC: answers back,
+    as monitor_window_focus() does. Writes in lost do not arrive. Returns the codes answered."""
+    codes = []
+    while port.writes:
+        for _, data in port.writes:
+            if data not in lost:
+                fake_board.SERIAL.rx += data
+        port.writes.clear()
+        pad["serial_receive"]()
+        for line in fake_board.SERIAL.replies():
+            code = json.loads(line).get("code", "")
+            codes.append(code)
+            if code[:5] == "MISS:" or code[:7] == "RESYNC:":
+                daemon.resend_profile(int(code.split(":")[1], 16))
+    return codes
+
+
+def connect(daemon, port):
+    """Make the daemon open port instead of COM4, and skip the Windows only calls."""
+    daemon.serial = types.SimpleNamespace(Serial=lambda *args, **kwargs: port)
+    daemon.cambiar_layout = lambda layout, recheck: None
+    daemon.STATS_POLL_SECONDS = 0
+
+
+def run_daemon(daemon, provider):
+    """Run the daemon loop in the background, as crear_icono() does."""
+    thread = threading.Thread(target=daemon.monitor_window_focus, args=(provider,), daemon=True)
+    thread.start()
+    return thread
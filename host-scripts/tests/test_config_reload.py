@@ -0,0 +1,32 @@
+"""Reload of config.json when the watcher sees it change.
+
+Some editors and file systems keep the modification time of a quick save,
+the size alone then tells the new file apart.
+"""
+
+import json
+import os
+
+import fake_host
+
+MTIME_NS = 1_700_000_000 * 10**9
+
+
+def write_config(path, raw):
+    path.write_text(json.dumps(raw))
+    os.utime(path, ns=(MTIME_NS, MTIME_NS))
+
+
+def test_size_only_change_reloads(tmp_path):
+    daemon = fake_host.load()
+    daemon.CONFIG_PATH = tmp_path / "config.json"
+    write_config(daemon.CONFIG_PATH, {".": {"keys": {"a1": "x"}, "colors": {}}})
+    assert daemon.reload_configs(daemon.config_signature())
+    assert daemon.resolve_profile("notepad.exe")[0]["keys"]["a1"] == "x"
+
+    write_config(daemon.CONFIG_PATH, {".": {"keys": {"a1": "xyz"}, "colors": {}}})
+    assert daemon.reload_configs(daemon.config_signature())
+    assert daemon.resolve_profile("notepad.exe")[0]["keys"]["a1"] == "xyz"
+
+    ## Same signature, nothing to read again
+    assert not daemon.reload_configs(daemon.config_signature())
@@ -0,0 +1,92 @@
+"""Time from a focus change to the profile written on the serial port.
+
+ScriptedWindowProvider plays a list of focus changes into the real
+monitor_window_focus() loop, which writes to a fake serial port. The first
+visit to a program composes and encodes its profile and sends it whole, or
+as a delta. Later visits come from the cache and only send ACTIVATE.
+
+Run as a script to print the latencies.
+"""
+
+import contextlib
+import io
+import statistics
+import struct
+
+import fake_host
+
+PROGRAMS = ["outlook.exe", "windowsterminal.exe", "code.exe", "teams.exe", "notepad.exe"]
+SWITCH_SECONDS = 0.005
+
+
+def focus_changes(rounds):
+    ## The same window twice in a row is not a change
+    return [PROGRAMS[index % len(PROGRAMS)] for index in range(rounds * len(PROGRAMS))]
+
+
+def run_focus_changes(programs):
+    daemon = fake_host.load()
+    port = fake_host.FakeSerial()
+    fake_host.connect(daemon, port)
+    changes = []
+
+    class RecordingProvider(daemon.ScriptedWindowProvider):
+        def next_window(self, timeout):
+            window = super().next_window(timeout)
+            if window:
+                changes.append(window[2])
+            return window
+
+    provider = RecordingProvider([(SWITCH_SECONDS, program, program) for program in programs])
+    fake_host.run_daemon(daemon, provider)
+    ## The default profile first, then one write per focus change
+    port.wait_profile_writes(1 + len(programs))
+    sent = port.profile_writes()[1:]
+    return daemon, changes, [
+        (program, (written - changed) * 1000, data)
+        for program, changed, (written, data) in zip(programs, changes, sent)
+    ]
+
+
+def sent_profile_id(daemon, data):
+    if data.startswith(b"ACTIVATE "):
+        return int(data[9:17], 16)
+    if data[0] == daemon.WIRE_DELTA_MAGIC:
+        return struct.unpack_from("<I", data, 4 + 6)[0]
+    return struct.unpack_from("<I", data, len(data) - 4)[0]
+
+
+def test_every_focus_change_writes_its_profile_once():
+    programs = focus_changes(4)
+    daemon, changes, results = run_focus_changes(programs)
+
+    assert len(changes) == len(programs)
+    ## Only profiles written before are activated by ID
+    written = {sent_profile_id(daemon, daemon.resolve_profile("")[1])}
+    for index, (program, latency, data) in enumerate(results):
+        profile_id = sent_profile_id(daemon, data)
+        if data.startswith(b"ACTIVATE "):
+            assert profile_id in written, program
+        else:
+            assert index < len(PROGRAMS), program
+            assert data[0] in (daemon.WIRE_MAGIC, daemon.WIRE_DELTA_MAGIC), program
+            written.add(profile_id)
+        assert latency >= 0
+    assert daemon.profile_cache_stats["misses"] == len(PROGRAMS) + 1
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return f"{statistics.median(latencies):>8.3f}{p95:>8.3f}{latencies[-1]:>8.3f}"
+
+
+if __name__ == "__main__":
+    ## The daemon logs every switch, only the summary is wanted here
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, results = run_focus_changes(focus_changes(40))
+    first = [latency for _, latency, _ in results[:len(PROGRAMS)]]
+    later = [latency for _, latency, _ in results[len(PROGRAMS):]]
+    print(f"{'focus change':<24}{'median':>8}{'p95':>8}{'max':>8}   ms to the serial write")
+    print(f"{'first visit (encode)':<24}{summary(first)}")
+    print(f"{'revisit (ACTIVATE)':<24}{summary(later)}")
@@ -0,0 +1,105 @@
+"""Profile lookup with thousands of synthetic profiles: prefix tree vs re.search.
+
+Three ways to find the profiles that match a window title, in precedence
+order:
+
+* before: lookup_config() as it was, re.search() with each key as it
+  stands in config.json. Past the re module cache, every key is compiled
+  again on every lookup.
+* compiled: compile_configs() patterns, one compiled re.search() per key.
+* combined: match_profiles(), one pass of the prefix tree over the title,
+  plus a search per key that is not a plain alternation of literals.
+
+All three must agree. Run as a script to print how the cost scales.
+"""
+
+import random
+import re
+import time
+
+import fake_host
+
+WORDS = ["mail", "code", "term", "chat", "docs", "sheet", "build", "browser", "notes", "music"]
+
+
+def synthetic_profiles(count, rng):
+    raw = {".": {"keys": {"a1": "x"}, "colors": {"a1": "ffffff"}}}
+    for index in range(count):
+        if index % 10 == 9:
+            ## A few keys are real expressions
+            clave = rf"^{rng.choice(WORDS)}\d*-{index}\b"
+        else:
+            clave = "|".join(f"{word}{index}" for word in rng.sample(WORDS, rng.randint(1, 3)))
+        raw[clave] = {"keys": {"a2": f"k{index}"}, "colors": {}}
+    return raw
+
+
+def synthetic_titles(count, profiles, rng):
+    titles = ["Untitled - Notepad", "", "Ünïcödé wíndow"]
+    for _ in range(count):
+        parts = [rng.choice(WORDS).upper() + str(rng.randrange(profiles)) for _ in range(rng.randint(1, 3))]
+        titles.append(" - ".join(parts) + rng.choice(["", " - App", "-12 x"]))
+    return titles
+
+
+def before(raw, title):
+    return [clave for clave in sorted(raw, key=len) if clave != "." and re.search(clave, title, re.IGNORECASE)]
+
+
+def compiled(index, title):
+    return [clave for clave, pattern, _ in index["patterns"] if pattern.search(title)]
+
+
+def combined(daemon, index, title):
+    return [index["patterns"][hit][0] for hit in daemon.match_profiles(index, title)]
+
+
+def build(count, seed=22):
+    daemon = fake_host.load()
+    rng = random.Random(seed)
+    raw = synthetic_profiles(count, rng)
+    index = daemon.compile_configs(raw, 0)
+    return daemon, raw, index, synthetic_titles(200, count, rng)
+
+
+def test_all_lookups_agree():
+    daemon, raw, index, titles = build(60)
+    for title in titles:
+        expected = before(raw, title)
+        assert compiled(index, title) == expected, title
+        assert combined(daemon, index, title) == expected, title
+    assert any(len(before(raw, title)) > 1 for title in titles)
+
+
+def test_combined_matcher_agrees_with_thousands_of_profiles():
+    daemon, _, index, titles = build(3000)
+    for title in titles:
+        assert combined(daemon, index, title) == compiled(index, title), title
+
+
+def test_config_json_profiles():
+    daemon = fake_host.load()
+    index = daemon.load_configs()
+    for title in ["OUTLOOK.EXE", "Mail - Inbox", "Windows Terminal", "code.exe", "Teams", "notepad.exe"]:
+        assert combined(daemon, index, title) == compiled(index, title), title
+
+
+def time_per_lookup(lookup, titles, budget=0.5):
+    start = time.perf_counter()
+    count = 0
+    while time.perf_counter() - start < budget:
+        for title in titles:
+            lookup(title)
+        count += len(titles)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+if __name__ == "__main__":
+    print(f"{'profiles':>9}{'before':>12}{'compiled':>12}{'combined':>12}   us per lookup")
+    for count in (10, 100, 1000, 5000):
+        daemon, raw, index, titles = build(count)
+        titles = titles[:50]
+        old = time_per_lookup(lambda title: before(raw, title), titles)
+        one_by_one = time_per_lookup(lambda title: compiled(index, title), titles)
+        trie = time_per_lookup(lambda title: combined(daemon, index, title), titles)
+        print(f"{count:>9}{old:>12.1f}{one_by_one:>12.1f}{trie:>12.1f}")
@@ -0,0 +1,152 @@
+"""Profiles sent by the daemon and applied by the pad, whole, as deltas or by ID.
+
+The daemon writes to a fake serial port, the writes go to the fake pad from
+tests/board/fake_board.py, and its MISS: and RESYNC: answers are handled
+as monitor_window_focus() does. The pad keeps the delta sequence number
+across activations, so it must see every delta the daemon counts. A frame
+damaged on the way is answered the same way, and sent again. Every profile
+is stored on the pad once, and is still there after a power cycle.
+"""
+
+import contextlib
+import io
+import os
+
+import fake_host
+from fake_host import fake_board
+
+PROGRAMS = ["outlook.exe", "windowsterminal.exe", "code.exe", "teams.exe", "notepad.exe"]
+
+
+def switch(daemon, port, program, pause_ms=None):
+    """Send the profile of program, with another pause if given. Returns what was written for it."""
+    config, payload = daemon.resolve_profile(program)
+    if pause_ms:
+        ## A delta cannot change the pause, this one goes whole
+        config = dict(config, pause_ms=pause_ms)
+        payload = daemon.encode_payload(config)
+    daemon.send_profile(config, payload)
+    return port.writes[0][1]
+
+
+def test_full_frames_deltas_and_activations_stay_in_sequence():
+    pad, daemon, port = fake_host.connected_pair()
+    sent = set()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(20):
+            if index % 7 == 6:
+                ## The pad forgot its profiles, they go out again as deltas or whole
+                daemon.device_profiles.clear()
+            data = switch(daemon, port, PROGRAMS[index % len(PROGRAMS)], 300 if index % 4 == 3 else None)
+            sent.add(data[0] if data[0] in (daemon.WIRE_MAGIC, daemon.WIRE_DELTA_MAGIC) else "ACTIVATE")
+            assert fake_host.deliver(pad, daemon, port) == []
+            assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+
+    assert sent == {daemon.WIRE_MAGIC, daemon.WIRE_DELTA_MAGIC, "ACTIVATE"}
+    assert pad["PROFILE_SEQ"] == daemon.delta_seq
+
+
+def test_lost_delta_is_resent_once():
+    pad, daemon, port = fake_host.connected_pair()
+    with contextlib.redirect_stdout(io.StringIO()):
+        switch(daemon, port, PROGRAMS[0])
+        fake_host.deliver(pad, daemon, port)
+        lost = switch(daemon, port, PROGRAMS[1])
+        assert lost[0] == daemon.WIRE_DELTA_MAGIC
+        fake_host.deliver(pad, daemon, port, lost=(lost,))
+
+        ## The next delta has the wrong base and sequence: the pad asks once, then follows again
+        daemon.device_profiles.clear()
+        assert switch(daemon, port, PROGRAMS[2])[0] == daemon.WIRE_DELTA_MAGIC
+        codes = fake_host.deliver(pad, daemon, port)
+        assert [code[:7] for code in codes] == ["RESYNC:"]
+        assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+
+        for program in PROGRAMS[3:]:
+            switch(daemon, port, program)
+            assert fake_host.deliver(pad, daemon, port) == []
+            assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+
+
+def damage(port, index=4):
+    ## The profile written arrives with a byte of its body changed
+    written, data = port.writes[0]
+    data = bytearray(data)
+    data[index] ^= 0xFF
+    port.writes[0] = (written, bytes(data))
+
+
+def test_damaged_frames_are_sent_again():
+    pad, daemon, port = fake_host.connected_pair()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert switch(daemon, port, PROGRAMS[0])[0] == daemon.WIRE_MAGIC
+        damage(port)
+        assert [code[:5] for code in fake_host.deliver(pad, daemon, port)] == ["MISS:"]
+        assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+
+        assert switch(daemon, port, PROGRAMS[1])[0] == daemon.WIRE_DELTA_MAGIC
+        ## Past the IDs, in the patches
+        damage(port, 16)
+        assert [code[:7] for code in fake_host.deliver(pad, daemon, port)] == ["RESYNC:"]
+        assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+
+        ## The next delta starts the count again
+        switch(daemon, port, PROGRAMS[2])
+        assert fake_host.deliver(pad, daemon, port) == []
+        assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+
+
+def test_unsupported_version_is_not_resent_forever():
+    pad, daemon, port = fake_host.connected_pair()
+    pad["WIRE_VERSION"] += 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        switch(daemon, port, PROGRAMS[0])
+        codes = fake_host.deliver(pad, daemon, port)
+
+    assert len(codes) == daemon.PROFILE_RESEND_MAX + 1
+    assert pad["ACTIVE_PROFILE_ID"] is None
+
+
+def use_store(pad, folder):
+    ## As on start up, with the store in folder
+    pad["PROFILE_STORE_INDEX"] = str(folder / "profiles.idx")
+    pad["PROFILE_STORE_DATA"] = str(folder / "profiles.dat")
+    pad["store_open"]()
+    pad["activate_stored"]("default")
+
+
+def stores(port):
+    return [data for _, data in port.writes if data.startswith(b"STORE ")]
+
+
+def test_every_profile_is_stored_once_and_survives_a_power_cycle(tmp_path):
+    pad, daemon, port = fake_host.connected_pair()
+    use_store(pad, tmp_path)
+    sent = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        daemon.send_profile(*daemon.resolve_profile(""), "default")
+        base_id = daemon.current_profile
+        sent += stores(port)
+        fake_host.deliver(pad, daemon, port)
+        for program in PROGRAMS * 2:
+            switch(daemon, port, program)
+            sent += stores(port)
+            assert fake_host.deliver(pad, daemon, port) == []
+
+    expected = [b"STORE %08x %08x\n" % (profile_id, profile_id) for profile_id in daemon.device_profiles]
+    assert sorted(sent) == sorted(expected + [b"STORE %08x default\n" % base_id])
+    size = os.path.getsize(pad["PROFILE_STORE_DATA"])
+
+    ## The pad starts again from its store, the daemon reconnects as monitor_window_focus() does
+    pad = fake_board.load()
+    use_store(pad, tmp_path)
+    assert pad["ACTIVE_PROFILE_ID"] == base_id
+    daemon.stored_names.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        daemon.send_profile(*daemon.resolve_profile(""), "default")
+        fake_host.deliver(pad, daemon, port)
+        for program in PROGRAMS:
+            assert switch(daemon, port, program).startswith(b"ACTIVATE ")
+            assert fake_host.deliver(pad, daemon, port) == []
+            assert pad["ACTIVE_PROFILE_ID"] == daemon.current_profile
+    assert os.path.getsize(pad["PROFILE_STORE_DATA"]) == size
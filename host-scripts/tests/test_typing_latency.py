@@ -0,0 +1,126 @@
+"""End to end typing of a UUID, on the pad vs from the PC.
+
+A MSG:TYPE:#NEW_UUID##UUID# key is pressed on the fake pad from
+tests/board/fake_board.py. Its report goes to the daemon through a fake
+serial port, and the daemon either sends TYPE "<uuid>" back for the pad to
+type through its HID layout, or types it from the PC on a fake keyboard.
+The time is taken from the key press to the last key going out.
+
+The pad types a few keys per pass of its main loop, so the matrix keeps
+being scanned while the UUID is typed.
+
+The fakes cost next to nothing, so the times are the processing of both
+programs under CPython. On the hardware each pad report also waits for a
+USB frame, at least 1 ms, and each key typed from the PC goes through
+Windows input injection, interleaved with the user's own keyboard.
+
+Run as a script to print the comparison.
+"""
+
+import json
+import time
+
+import fake_host
+from fake_host import fake_board
+
+TYPE_KEY = "e3"
+USB_FRAME_MS = 1
+
+
+def connected_pair(layout):
+    pad, daemon, port = fake_host.connected_pair()
+    pad["load_config"]({"colors": {}, "keys": {TYPE_KEY: "MSG:TYPE:#NEW_UUID##UUID#"}})
+    daemon.keyboard = fake_host.FakeKeyboard()
+    ## The pad types with the US layout, the daemon only asks it to when Windows uses it too
+    daemon.obtener_layout_actual = lambda: daemon.layouts[layout]
+    return pad, daemon, port
+
+
+def press_type_key(pad, daemon, port):
+    """Press the key and carry its report and the answer across, then run the pad's main loop
+    until it is done typing. Returns the elapsed seconds and the loop passes spent typing."""
+    start = time.perf_counter()
+    fake_board.press(pad, TYPE_KEY)
+    fake_board.loop_pass(pad)
+
+    ## What monitor_window_focus() does with a TYPE: code
+    port.reply(fake_board.SERIAL.tx.rstrip(b"\n"))
+    fake_board.SERIAL.tx.clear()
+    data = json.loads(port.readline().decode("utf-8").strip())
+    writes = len(port.writes)
+    daemon.type_text(data["code"][5:])
+
+    for _, line in port.writes[writes:]:
+        fake_board.SERIAL.rx += line
+    fake_board.release(pad, TYPE_KEY)
+    passes = 0
+    while True:
+        samples = fake_board.MATRIX.samples
+        fake_board.loop_pass(pad)
+        assert fake_board.MATRIX.samples > samples, "no scan in this pass"
+        passes += 1
+        if not pad["macro_busy"]():
+            break
+    elapsed = time.perf_counter() - start
+    return elapsed, passes
+
+
+def typed_on_pad(pad):
+    ## Characters typed, from the keys each HID report adds to the one before
+    layout = pad["keyboard_layout"]
+    shift = pad["Keycode"].SHIFT
+    chars = {}
+    for code in range(32, 127):
+        keycodes = layout.keycodes(chr(code))
+        chars[(keycodes[-1], shift in keycodes[:-1])] = chr(code)
+
+    text = ""
+    held = set()
+    for report in fake_board.HID.reports:
+        keys = {key for key in report[2:] if key}
+        for key in keys - held:
+            text += chars[(key, bool(report[0] & 0x02))]
+        held = keys
+    return text
+
+
+def test_pad_types_the_uuid_when_the_layout_matches():
+    pad, daemon, port = connected_pair("EN")
+    _, passes = press_type_key(pad, daemon, port)
+
+    ## Spread over passes that each scan the matrix
+    assert passes >= 36 // pad["MACRO_OPS_PER_STEP"]
+    assert len(daemon.latest_uuid) == 36
+    assert typed_on_pad(pad) == daemon.latest_uuid
+    assert daemon.keyboard.typed == []
+    assert fake_board.HID.reports[-1] == bytes(8)
+
+
+def test_pc_types_the_uuid_with_another_layout():
+    pad, daemon, port = connected_pair("ES")
+    press_type_key(pad, daemon, port)
+
+    assert "".join(key for _, key in daemon.keyboard.typed) == daemon.latest_uuid
+    assert not any(report[2:].strip(b"\0") for report in fake_board.HID.reports)
+
+
+def timed(layout, runs=200):
+    pad, daemon, port = connected_pair(layout)
+    best = None
+    for _ in range(runs):
+        fake_board.HID.reports.clear()
+        daemon.keyboard.typed.clear()
+        elapsed, passes = press_type_key(pad, daemon, port)
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, len(fake_board.HID.reports), len(daemon.keyboard.typed), passes
+
+
+if __name__ == "__main__":
+    pad_ms, reports, _, passes = timed("EN")
+    pc_ms, _, events, _ = timed("ES")
+    print(f"{'typing a UUID':<16}{'ms':>8}   output")
+    print(
+        f"{'on the pad':<16}{pad_ms:>8.3f}   {reports} HID reports, at least {reports * USB_FRAME_MS} ms "
+        f"of USB frames, over {passes} loop passes that each scan the keys"
+    )
+    print(f"{'from the PC':<16}{pc_ms:>8.3f}   {events} injected key events")
@@ -0,0 +1,76 @@
+"""Binary profile frames against the JSON lines they replace.
+
+Every profile in config.json, merged over "." as the daemon sends it, is
+encoded both ways. The fake pad from tests/board/fake_board.py must end
+up with the same actions and LED frame from either, and the frame must be
+the smaller of the two.
+
+Run as a script to print the sizes and the time serial_message() takes
+to load each on the pad, under CPython.
+"""
+
+import contextlib
+import io
+import json
+import time
+
+import fake_host
+from fake_host import fake_board
+
+
+def config_profiles(daemon):
+    """(profile key, merged config) for every profile in config.json."""
+    raw = json.loads(daemon.CONFIG_PATH.read_text())
+    profiles = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for clave in raw:
+            ## A window title the key matches, "." alone matches any other
+            title = "" if clave == "." else clave.split("|")[0]
+            profiles.append((clave, daemon.lookup_config(title)))
+    return profiles
+
+
+def encodings(daemon, config):
+    ## config.json has symbols the pad has no key for, each one is reported
+    with contextlib.redirect_stdout(io.StringIO()):
+        return json.dumps(config).encode(), daemon.encode_profile(config)
+
+
+def loaded(pad, message):
+    pad["serial_message"](message)
+    return dict(pad["MATRIX_ACTIONS"]), bytes(pad["LED_FRAME"])
+
+
+def test_frames_load_like_json_and_are_smaller():
+    daemon = fake_host.load()
+    pad = fake_board.load()
+    profiles = config_profiles(daemon)
+    assert len(profiles) == 5
+
+    for clave, config in profiles:
+        line, frame = encodings(daemon, config)
+        assert frame is not None, clave
+        assert len(frame) < len(line), clave
+        assert loaded(pad, frame) == loaded(pad, line), clave
+        assert pad["ACTIVE_PROFILE_ID"] is None
+
+
+def time_load(pad, message, budget=0.2):
+    start = time.perf_counter()
+    count = 0
+    while time.perf_counter() - start < budget:
+        pad["serial_message"](message)
+        count += 1
+    return (time.perf_counter() - start) / count * 1e6
+
+
+if __name__ == "__main__":
+    daemon = fake_host.load()
+    pad = fake_board.load()
+    print(f"{'profile':<22}{'JSON B':>8}{'frame B':>9}{'JSON us':>10}{'frame us':>10}   to load on the pad")
+    for clave, config in config_profiles(daemon):
+        line, frame = encodings(daemon, config)
+        with contextlib.redirect_stdout(io.StringIO()):
+            json_us = time_load(pad, line)
+            frame_us = time_load(pad, frame)
+        print(f"{clave:<22}{len(line):>8}{len(frame):>9}{json_us:>10.1f}{frame_us:>10.1f}")
@@ -0,0 +1,336 @@
+"""Fake CircuitPython modules, to run code.py and its libraries under CPython.
+
+Importing this module installs stand-ins for the board modules in
+sys.modules and puts board-ssd/lib on the path, so code.py and the real
+adafruit_hid, adafruit_register and framework_is31fl3743 run unchanged.
+load() runs code.py up to its main loop and returns its globals.
+
+The fakes keep what the tests look at:
+
+* MATRIX.pressed holds the (row, column) positions held down. The ADC
+  reads low while the selected row and a driven column meet on one of them.
+* CLOCK drives supervisor.ticks_ms(). It follows the real clock until a
+  test sets CLOCK.now.
+* SERIAL stands in for usb_cdc.data. The host side writes into SERIAL.rx,
+  the pad's replies pile up in SERIAL.tx.
+* I2C buses count their transactions and the bytes written.
+* HID.reports lists every keyboard report sent.
+
+loop_pass() runs one pass of the main loop, and recording_pad() stands a
+recorder in for one of code.py's functions.
+"""
+
+import binascii
+import gc
+import os
+import struct
+import sys
+import time
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BOARD_DIR = os.path.join(REPO_DIR, "board-ssd")
+CODE_PATH = os.path.join(BOARD_DIR, "code.py")
+sys.path.insert(0, os.path.join(BOARD_DIR, "lib"))
+
+TICKS_MAX = (1 << 29) - 1
+
+
+def install(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+# === board and digitalio ===
+PINS = {}   # Pin name -> last DigitalInOut created on it
+
+
+class Direction:
+    INPUT = 0
+    OUTPUT = 1
+
+
+class Pull:
+    UP = 1
+    DOWN = 2
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = 1
+        self.direction = Direction.INPUT
+        self.pull = None
+        PINS[pin] = self
+
+    def deinit(self):
+        pass
+
+
+BOARD_PINS = [
+    "GP0", "GP6", "GP7", "GP28", "GP29", "SCL", "SDA",
+    "MUX_ENABLE", "MUX_A", "MUX_B", "MUX_C", "BOOT_DONE",
+] + ["KSO%d" % col for col in range(16)]
+
+install("board", **{name: name for name in BOARD_PINS})
+install("digitalio", DigitalInOut=DigitalInOut, Direction=Direction, Pull=Pull)
+
+
+# === analogio, wired to a fake key matrix ===
+class Matrix:
+    def __init__(self):
+        self.pressed = set()    # (row, column) held down
+        self.low = 0            # ADC reading of a key held down
+        self.samples = 0        # ADC reads so far
+
+    def sample(self):
+        self.samples += 1
+        if not self.pressed:
+            return 65535
+        row = (
+            (1 if PINS["MUX_A"].value else 0)
+            | (2 if PINS["MUX_B"].value else 0)
+            | (4 if PINS["MUX_C"].value else 0)
+        )
+        for col in range(16):
+            if not PINS["KSO%d" % col].value and (row, col) in self.pressed:
+                return self.low
+        return 65535
+
+
+MATRIX = Matrix()
+
+
+class AnalogIn:
+    def __init__(self, pin):
+        self.pin = pin
+
+    @property
+    def value(self):
+        return MATRIX.sample()
+
+
+install("analogio", AnalogIn=AnalogIn)
+
+
+# === busio and adafruit_bus_device, a fake IS31FL3743 ===
+class I2C:
+    def __init__(self, *pins):
+        self.pages = [bytearray(256) for _ in range(3)]
+        self.page = 0
+        self.transactions = 0
+        self.bytes_written = 0
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def scan(self):
+        return [0x20]
+
+    def reset_counts(self):
+        self.transactions = 0
+        self.bytes_written = 0
+
+
+class I2CDevice:
+    def __init__(self, i2c, address):
+        self.i2c = i2c
+        self.address = address
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buf, *, start=0, end=None):
+        data = bytes(buf[start:end])
+        bus = self.i2c
+        bus.transactions += 1
+        bus.bytes_written += len(data)
+        reg = data[0]
+        if reg == 0xFD:
+            bus.page = data[1]
+        elif reg != 0xFE:
+            bus.pages[bus.page][reg:reg + len(data) - 1] = data[1:]
+
+    def write_then_readinto(self, out_buf, in_buf, *, out_start=0, out_end=None,
+                            in_start=0, in_end=None):
+        bus = self.i2c
+        bus.transactions += 1
+        reg = out_buf[out_start]
+        if in_end is None:
+            in_end = len(in_buf)
+        if reg == 0xFC:
+            in_buf[in_start] = 2 * self.address     # ID register
+            return
+        in_buf[in_start:in_end] = bus.pages[bus.page][reg:reg + in_end - in_start]
+
+
+install("busio", I2C=I2C)
+bus_device = install("adafruit_bus_device")
+bus_device.i2c_device = install("adafruit_bus_device.i2c_device", I2CDevice=I2CDevice)
+
+
+# === usb_hid and usb_cdc ===
+class HIDDevice:
+    usage_page = 0x01
+    usage = 0x06
+
+    def __init__(self):
+        self.reports = []
+
+    def send_report(self, report, report_id=None):
+        self.reports.append(bytes(report))
+
+    def get_last_received_report(self, report_id=None):
+        return None
+
+
+HID = HIDDevice()
+install("usb_hid", devices=[HID], Device=HIDDevice)
+
+
+class Serial:
+    def __init__(self):
+        self.rx = bytearray()   # Waiting to be read by the pad
+        self.tx = bytearray()   # Written by the pad
+        self.timeout = 1
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def readinto(self, buf):
+        count = min(len(buf), len(self.rx))
+        buf[:count] = self.rx[:count]
+        del self.rx[:count]
+        return count
+
+    def read(self, count=None):
+        if count is None:
+            count = len(self.rx)
+        data = bytes(self.rx[:count])
+        del self.rx[:count]
+        return data
+
+    def write(self, data):
+        self.tx += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def replies(self):
+        ## Lines written by the pad since the last call
+        lines = bytes(self.tx).decode().splitlines()
+        self.tx.clear()
+        return lines
+
+
+SERIAL = Serial()
+install("usb_cdc", data=SERIAL)
+
+
+# === supervisor and micropython ===
+class Clock:
+    def __init__(self):
+        self.now = None     # Milliseconds, None follows the real clock
+
+    def ticks_ms(self):
+        if self.now is None:
+            return int(time.monotonic() * 1000) & TICKS_MAX
+        return self.now & TICKS_MAX
+
+    def advance(self, ms):
+        if self.now is None:
+            self.now = int(time.monotonic() * 1000)
+        self.now += ms
+
+
+class Runtime:
+    usb_connected = True
+
+
+CLOCK = Clock()
+install("supervisor", ticks_ms=CLOCK.ticks_ms, runtime=Runtime())
+install("micropython", const=lambda value: value)
+
+## The libraries' annotations are evaluated by CPython, not by CircuitPython
+typing_module = install("circuitpython_typing", ReadableBuffer=bytes, WriteableBuffer=bytearray)
+typing_module.device_drivers = install("circuitpython_typing.device_drivers", I2CDeviceDriver=object)
+typing_module.pil = install("circuitpython_typing.pil", Image=object)
+install("adafruit_framebuf", FrameBuffer=object)
+
+## CPython has no gc.mem_free(), the profile cache checks it
+if not hasattr(gc, "mem_free"):
+    gc.mem_free = lambda: 128 * 1024
+
+
+def load():
+    """Run code.py up to its main loop and return its globals."""
+    MATRIX.pressed.clear()
+    MATRIX.low = 0
+    MATRIX.samples = 0
+    CLOCK.now = None
+    SERIAL.rx.clear()
+    SERIAL.tx.clear()
+    HID.reports.clear()
+
+    with open(CODE_PATH) as f:
+        source = f.read()
+    source = source[:source.index("# === Main Execution Loop ===")]
+    pad = {"__name__": "code"}
+    exec(compile(source, CODE_PATH, "exec"), pad)
+    ## Set up by the main loop on the pad
+    pad["usb_serial"] = SERIAL
+    return pad
+
+
+def loop_pass(pad):
+    """One pass of code.py's main loop while the host is awake, without the idle pause."""
+    now = CLOCK.ticks_ms()
+    pad["serial_receive"]()
+    pad["matrix_scan"]()
+    pad["events_run"](CLOCK.ticks_ms())
+    pad["macro_step"](CLOCK.ticks_ms())
+    pad["scan_done"](now)
+
+
+def wire_frame(body, magic=0xA5):
+    """A binary profile frame around body, as the daemon sends it."""
+    header = struct.pack("<BBH", magic, 1, len(body))
+    return header + body + struct.pack("<I", binascii.crc32(body))
+
+
+def recording_pad(name, record):
+    """Run code.py with its function name replaced. Each call adds record(pad, *args) to the list returned."""
+    pad = load()
+    calls = []
+
+    def replacement(*args):
+        calls.append(record(pad, *args))
+
+    pad[name] = replacement
+    return pad, calls
+
+
+def press(pad, key):
+    """Hold a key of code.py's MATRIX down on the fake matrix."""
+    MATRIX.pressed.add(position(pad, key))
+
+
+def release(pad, key):
+    MATRIX.pressed.discard(position(pad, key))
+
+
+def position(pad, key):
+    for row, keys in enumerate(pad["MATRIX"]):
+        if key in keys:
+            return row, keys.index(key)
+    raise KeyError(key)
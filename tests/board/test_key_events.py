@@ -0,0 +1,99 @@
+"""Stress test of the key event queue between matrix_scan() and events_run().
+
+The fake matrix changes between scans faster than a person could type,
+with several keys at once, while the executor falls behind. Every edge the
+scan sees has to reach process_key(), in order and with the chord held at
+that moment.
+"""
+
+import random
+
+import fake_board
+
+
+def slow_process_key(pad, key, is_pressed):
+    ## A slow action, the scan must not notice
+    fake_board.CLOCK.advance(30)
+    return key, is_pressed, pad["key_state"]
+
+
+def set_matrix(pad, held):
+    fake_board.MATRIX.pressed = {fake_board.position(pad, key) for key in held}
+
+
+def scan(pad):
+    pad["matrix_scan"]()
+    fake_board.CLOCK.advance(1)
+
+
+def expected_edges(pad, before, after):
+    ## Edges for one scan, in KEYS order like matrix_edges()
+    edges = []
+    for key in pad["KEYS"]:
+        if (key in before) != (key in after):
+            edges.append((key, key in after))
+    return edges
+
+
+def test_rapid_multi_key_input_keeps_every_edge():
+    pad, seen = fake_board.recording_pad("process_key", slow_process_key)
+    fake_board.CLOCK.now = 0
+    keys = pad["KEYS"]
+    rng = random.Random(16)
+
+    held = set()
+    expected = []
+    for _ in range(2000):
+        ## Up to four keys change at once, each state lasts a single scan
+        new = set(held)
+        for key in rng.sample(keys, rng.randint(1, 4)):
+            new.symmetric_difference_update((key,))
+        set_matrix(pad, new)
+        scan(pad)
+        expected.extend(expected_edges(pad, held, new))
+        held = new
+        pad["events_run"](fake_board.CLOCK.ticks_ms())
+
+    assert [(key, pressed) for key, pressed, _ in seen] == expected
+    assert pad["EVENT_OVERFLOWS"] == 0
+
+    ## The executor saw each chord as it was held
+    state = 0
+    for key, pressed, key_state in seen:
+        bit = 1 << keys.index(key)
+        if pressed:
+            state |= bit
+        assert key_state == state
+        if not pressed:
+            state &= ~bit
+    assert pad["key_state"] == pad["scan_state"]
+
+
+def test_full_queue_defers_edges_without_losing_them():
+    pad, seen = fake_board.recording_pad("process_key", slow_process_key)
+    fake_board.CLOCK.now = 0
+    keys = pad["KEYS"]
+    rng = random.Random(32)
+
+    ## The executor stalls while every key goes down and up again
+    held = set()
+    for _ in range(6):
+        for key in rng.sample(keys, len(keys)):
+            held.symmetric_difference_update((key,))
+            set_matrix(pad, held)
+            scan(pad)
+    assert pad["event_len"] == pad["EVENT_QUEUE_SIZE"]
+    assert pad["EVENT_OVERFLOWS"] > 0
+
+    ## Keys held long enough are caught up with once the executor runs again
+    for _ in range(20):
+        scan(pad)
+        pad["events_run"](fake_board.CLOCK.ticks_ms())
+    assert pad["event_len"] == 0
+    assert pad["key_state"] == pad["scan_state"]
+
+    ## Per key, presses and releases still alternate, starting with a press
+    for key in keys:
+        edges = [pressed for name, pressed, _ in seen if name == key]
+        assert edges == [index % 2 == 0 for index in range(len(edges))]
+        assert (len(edges) % 2 == 1) == (key in held)
@@ -0,0 +1,61 @@
+"""Long macros run a few ops per pass of the main loop, with scans in between.
+
+A key types a macro with no \\p pauses. macro_start() only queues it and each
+pass of the main loop runs at most MACRO_OPS_PER_STEP of its ops, so the
+matrix keeps being scanned and a release is seen while it is still typing.
+"""
+
+import fake_board
+
+MACRO_KEY = "e3"
+TEXT = "thequickbrownfoxjumpsoverthelazydog"
+
+
+def macro_pad():
+    pad = fake_board.load()
+    symbols = {char: char.upper() for char in set(TEXT)}
+    pad["load_config"]({"colors": {}, "keys": {MACRO_KEY: TEXT}, "symbols": symbols})
+    return pad
+
+
+def typed_keys(pad):
+    return [report[2] for report in fake_board.HID.reports if report[2]]
+
+
+def test_macro_start_only_queues():
+    pad = macro_pad()
+    fake_board.press(pad, MACRO_KEY)
+    pad["matrix_scan"]()
+    pad["events_run"](fake_board.CLOCK.ticks_ms())
+
+    assert pad["macro_busy"]()
+    assert fake_board.HID.reports == []
+
+
+def test_long_macro_is_spread_over_loop_passes():
+    pad = macro_pad()
+    budget = pad["MACRO_OPS_PER_STEP"]
+    fake_board.press(pad, MACRO_KEY)
+
+    passes = 0
+    released_while_typing = False
+    while True:
+        reports = len(fake_board.HID.reports)
+        samples = fake_board.MATRIX.samples
+        fake_board.loop_pass(pad)
+        passes += 1
+        assert fake_board.MATRIX.samples > samples, "no scan in this pass"
+        ## A tap is a press and a release report
+        assert len(fake_board.HID.reports) - reports <= 2 * budget
+        if passes == 2:
+            fake_board.release(pad, MACRO_KEY)
+        elif passes == 3:
+            assert pad["key_state"] == 0
+            released_while_typing = pad["macro_busy"]()
+        if not pad["macro_busy"]():
+            break
+
+    assert released_while_typing
+    assert passes > len(TEXT) // budget
+    assert typed_keys(pad) == [getattr(pad["Keycode"], char.upper()) for char in TEXT]
+    assert fake_board.HID.reports[-1] == bytes(8)
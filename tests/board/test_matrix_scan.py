@@ -0,0 +1,94 @@
+"""matrix_scan() against the scan it replaced, and its time per scan.
+
+The old scan walked all 8x4 positions column by column, converted every
+ADC sample to a float voltage and kept held keys in a list. The new one
+walks the precomputed SCAN_TABLE, compares raw ADC units and keeps a
+bitmask. Both run here on the fake analogio/digitalio pins.
+
+Run as a script to print the time per scan.
+"""
+
+import random
+import time
+
+import fake_board
+
+
+def to_voltage(adc_sample):
+    return (adc_sample * 3.3) / 65536
+
+
+def old_scan(pad, pressed):
+    ## matrix_scan() as it was, actions left out
+    for col in range(pad["MATRIX_COLS"]):
+        pad["drive_col"](col, 0)
+        for row in range(pad["MATRIX_ROWS"]):
+            key = pad["MATRIX"][row][col]
+            if key:
+                pad["mux_select_row"](row)
+                if to_voltage(pad["adc_in"].value) < pad["ADC_THRESHOLD"]:
+                    if key not in pressed:
+                        pressed.append(key)
+                else:
+                    if key in pressed:
+                        pressed.remove(key)
+        pad["drive_col"](col, 1)
+
+
+def scanning_pad():
+    pad = fake_board.load()
+    pad["event_push"] = lambda index, pressed, now: True
+    return pad
+
+
+def held_keys(pad):
+    return {key for index, key in enumerate(pad["KEYS"]) if pad["scan_state"] & (1 << index)}
+
+
+def test_raw_threshold_matches_the_voltage_threshold():
+    threshold = scanning_pad()["ADC_THRESHOLD_RAW"]
+    assert threshold == 7944
+    for sample in range(65536):
+        assert (sample < threshold) == (to_voltage(sample) < 0.4), sample
+
+
+def test_scan_finds_the_same_keys_as_before():
+    pad = scanning_pad()
+    rng = random.Random(8)
+    pressed = []
+    for _ in range(300):
+        held = set(rng.sample(pad["KEYS"], rng.randint(0, 6)))
+        fake_board.MATRIX.pressed = {fake_board.position(pad, key) for key in held}
+        ## Readings on both sides of the threshold
+        fake_board.MATRIX.low = rng.choice((0, 7943, 7944, 20000))
+        old_scan(pad, pressed)
+        pad["matrix_scan"]()
+        assert held_keys(pad) == set(pressed)
+
+
+def test_scan_switches_the_multiplexer_once_per_row():
+    pad = scanning_pad()
+    switches = []
+    select = pad["mux_select_row"]
+    pad["mux_select_row"] = lambda row: (switches.append(row), select(row))
+    pad["matrix_scan"]()
+    assert switches == sorted(set(row for row, _, _ in pad["SCAN_TABLE"]))
+    assert len(pad["SCAN_TABLE"]) == sum(1 for keys in pad["MATRIX"] for key in keys if key)
+
+
+def time_per_scan(scan, scans=2000):
+    start = time.perf_counter()
+    for _ in range(scans):
+        scan()
+    return (time.perf_counter() - start) / scans * 1e6
+
+
+if __name__ == "__main__":
+    pad = scanning_pad()
+    pressed = []
+    old = time_per_scan(lambda: old_scan(pad, pressed))
+    new = time_per_scan(pad["matrix_scan"])
+    print(f"{'scan':<8}{'us per scan':>12}")
+    print(f"{'before':<8}{old:>12.1f}")
+    print(f"{'after':<8}{new:>12.1f}")
+    print("CPython with fake pins. On the pad the pin and ADC calls weigh more.")
@@ -0,0 +1,104 @@
+"""Profile store on the pad's flash, in a temporary folder.
+
+Profiles are sent as binary frames and stored with STORE. A fresh
+fake_board.load() stands for a power cycle: it reads the index again as
+code.py does on start up, and gets the profiles back from the data file.
+"""
+
+import binascii
+import json
+import os
+import struct
+
+import fake_board
+
+
+def store_pad(tmp_path, **settings):
+    pad = fake_board.load()
+    pad["PROFILE_STORE_INDEX"] = str(tmp_path / "profiles.idx")
+    pad["PROFILE_STORE_DATA"] = str(tmp_path / "profiles.dat")
+    pad.update(settings)
+    pad["store_open"]()
+    return pad
+
+
+def profile_body(seed, text_size=10):
+    ## Colors and a message on a1, both different for each seed
+    colors = bytes((seed * 7 + index) % 256 for index in range(72))
+    text = (b"MSG:%d:" % seed).ljust(text_size, b"x")
+    return colors + bytes((1,)) + struct.pack("<IBH", 1, 1, len(text)) + text
+
+
+def upload(pad, body, name):
+    ## What the daemon sends for a profile the pad has not seen
+    pad["serial_message"](fake_board.wire_frame(body))
+    profile_id = binascii.crc32(body)
+    pad["serial_message"](b"STORE %08x %s" % (profile_id, name.encode()))
+    return profile_id
+
+
+def test_stored_profiles_survive_a_power_cycle(tmp_path):
+    pad = store_pad(tmp_path)
+    ids = [upload(pad, profile_body(seed), f"p{seed}") for seed in range(3)]
+    upload(pad, profile_body(0), "default")
+    profiles = {profile_id: pad["PROFILE_CACHE"][profile_id] for profile_id in ids}
+    ## Names of the same profile share its data
+    assert os.path.getsize(pad["PROFILE_STORE_DATA"]) == sum(
+        len(pad["store_encode"](profile)) for profile in profiles.values()
+    )
+
+    pad = store_pad(tmp_path)
+    pad["activate_stored"]("default")
+    assert pad["ACTIVE_PROFILE_ID"] == ids[0]
+    for profile_id in ids:
+        pad["serial_message"](b"ACTIVATE %08x" % profile_id)
+        assert pad["ACTIVE_PROFILE"] == profiles[profile_id]
+    assert fake_board.SERIAL.replies() == []
+
+
+def test_index_swapped_in_after_a_power_loss(tmp_path):
+    pad = store_pad(tmp_path)
+    profile_id = upload(pad, profile_body(1), "default")
+    ## Power lost after the old index was removed, before the new one was renamed
+    os.rename(pad["PROFILE_STORE_INDEX"], pad["PROFILE_STORE_INDEX"] + ".tmp")
+
+    pad = store_pad(tmp_path)
+    pad["activate_stored"]("default")
+    assert pad["ACTIVE_PROFILE_ID"] == profile_id
+
+
+def test_compaction_keeps_the_named_profiles(tmp_path):
+    settings = {"PROFILE_STORE_MAX_SIZE": 2000, "PROFILE_STORE_MAX_NAMES": 3}
+    pad = store_pad(tmp_path, **settings)
+    ids = {}
+    for seed in range(12):
+        ids[f"p{seed}"] = upload(pad, profile_body(seed, 400), f"p{seed}")
+        ## Past the largest size the data file is rewritten with what is still named
+        assert os.path.getsize(pad["PROFILE_STORE_DATA"]) <= 2000 + 500
+    kept = [entry[3] for entry in pad["STORE_INDEX"]]
+    assert kept == ["p9", "p10", "p11"]
+    assert not os.path.exists(pad["PROFILE_STORE_DATA"] + ".tmp")
+
+    pad = store_pad(tmp_path, **settings)
+    for name in kept:
+        pad["activate_stored"](name)
+        assert pad["ACTIVE_PROFILE_ID"] == ids[name]
+    pad["serial_message"](b"ACTIVATE %08x" % ids["p0"])
+    assert fake_board.SERIAL.replies() == [json.dumps({"code": "MISS:%08x" % ids["p0"]})]
+
+
+def test_damaged_profile_is_asked_for_again(tmp_path):
+    pad = store_pad(tmp_path)
+    upload(pad, profile_body(1), "p1")
+    profile_id = upload(pad, profile_body(2), "p2")
+    offset = pad["store_find"](profile_id)[1]
+    with open(pad["PROFILE_STORE_DATA"], "r+b") as file:
+        file.seek(offset + 80)
+        file.write(b"?")
+
+    pad = store_pad(tmp_path)
+    pad["serial_message"](b"ACTIVATE %08x" % profile_id)
+    assert fake_board.SERIAL.replies() == [json.dumps({"code": "MISS:%08x" % profile_id})]
+    assert pad["ACTIVE_PROFILE_ID"] is None
+    pad["activate_stored"]("p1")
+    assert pad["ACTIVE_PROFILE_ID"] == binascii.crc32(profile_body(1))
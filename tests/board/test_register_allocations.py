@@ -0,0 +1,114 @@
+"""Bytes allocated per register access, with and without preallocate.
+
+The fake I2C device keeps every buffer handed to it, so even buffers that
+would be freed right away on the pad show up in the tracemalloc snapshot.
+Only allocations made by adafruit_register itself are counted.
+
+Run as a script to print the comparison table.
+"""
+
+import tracemalloc
+
+import fake_board
+from adafruit_register.i2c_struct import UnaryStruct
+from adafruit_register.i2c_struct_array import StructArray
+
+ACCESSES = 200
+
+
+class KeepingDevice(fake_board.I2CDevice):
+    def __init__(self, i2c, address):
+        super().__init__(i2c, address)
+        self.buffers = []
+
+    def write(self, buf, **kwargs):
+        self.buffers.append(buf)
+        super().write(buf, **kwargs)
+
+    def write_then_readinto(self, out_buf, in_buf, **kwargs):
+        self.buffers.append(out_buf)
+        self.buffers.append(in_buf)
+        super().write_then_readinto(out_buf, in_buf, **kwargs)
+
+
+def make_device(preallocate):
+    class Device:
+        value = UnaryStruct(0x10, "<H", preallocate=preallocate)
+        table = StructArray(0x20, "<BB", 16, preallocate=preallocate)
+
+        def __init__(self):
+            self.i2c_device = KeepingDevice(fake_board.I2C(), 0x20)
+
+    return Device()
+
+
+def read_value(device):
+    return device.value
+
+
+def write_value(device):
+    device.value = 0x1234
+
+
+def read_element(device):
+    return device.table[5]
+
+
+def write_element(device):
+    device.table[5] = (1, 2)
+
+
+def read_slice(device):
+    return device.table[2:10]
+
+
+def write_slice(device):
+    device.table[2:6] = [(1, 2)] * 4
+
+
+ACCESS_KINDS = (read_value, write_value, read_element, write_element, read_slice, write_slice)
+
+
+def allocated_per_access(access, preallocate):
+    device = make_device(preallocate)
+    ## Buffers made once, on first use, are not per access
+    access(device)
+    tracemalloc.start()
+    try:
+        for _ in range(ACCESSES):
+            access(device)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(True, "*adafruit_register*")])
+    return sum(stat.size for stat in snapshot.statistics("filename")) / ACCESSES
+
+
+def test_preallocated_registers_do_not_allocate():
+    for access in ACCESS_KINDS:
+        assert allocated_per_access(access, True) == 0, access.__name__
+
+
+def test_plain_registers_allocate_a_buffer_per_access():
+    ## Makes sure the measurement would see the allocations being avoided
+    for access in ACCESS_KINDS:
+        assert allocated_per_access(access, False) > 0, access.__name__
+
+
+def test_preallocated_registers_read_back_what_was_written():
+    device = make_device(True)
+    device.value = 0xBEEF
+    device.table[3] = (7, 8)
+    device.table[8:11] = [(1, 2), (3, 4), (5, 6)]
+    assert device.value == 0xBEEF
+    assert device.table[3] == (7, 8)
+    assert device.table[8:11] == [(1, 2), (3, 4), (5, 6)]
+    assert device.table[0:0] == []
+
+
+if __name__ == "__main__":
+    print(f"{'access':<16}{'plain':>10}{'preallocated':>14}   bytes per access")
+    for access in ACCESS_KINDS:
+        plain = allocated_per_access(access, False)
+        preallocated = allocated_per_access(access, True)
+        print(f"{access.__name__:<16}{plain:>10.0f}{preallocated:>14.0f}")
@@ -0,0 +1,81 @@
+"""I2C transactions for a full LED repaint, before and after the buffered driver.
+
+Before, matrix_paint() wrote each key channel through an unbuffered
+IS31FL3743, one transaction per channel. Now the pixel buffer is sent with
+show() in contiguous register runs. The fake bus counts both.
+
+Run as a script to print the comparison.
+"""
+
+import fake_board
+
+
+def all_colors(pad, color):
+    return {key: color for key in pad["MATRIX_LED_MAP"]}
+
+
+def repaint_before(pad, colors):
+    ## matrix_paint() as it was, on the unbuffered driver
+    i2c = fake_board.I2C()
+    is31 = pad["IS31FL3743"](i2c)
+    i2c.reset_counts()
+    for key, led in pad["MATRIX_LED_MAP"].items():
+        value = colors.get(key, None)
+        if value:
+            is31[led + 2] = int(value[:2], 16)
+            is31[led + 1] = int(value[2:4], 16)
+            is31[led + 0] = int(value[-2:], 16)
+        else:
+            is31[led + 2] = 0x00
+            is31[led + 1] = 0x00
+            is31[led + 0] = 0x00
+    return i2c
+
+
+def repaint_after(pad, colors):
+    i2c = pad["i2c"]
+    pad["decode_colors"](colors)
+    i2c.reset_counts()
+    pad["matrix_paint"]()
+    return i2c
+
+
+def led_registers(pad, i2c):
+    return {led: i2c.pages[0][led] for led in pad["LED_CHANNELS"]}
+
+
+def test_full_repaint_is_one_burst():
+    pad = fake_board.load()
+    colors = all_colors(pad, "a1b2c3")
+
+    before = repaint_before(pad, colors)
+    after = repaint_after(pad, colors)
+
+    assert before.transactions >= len(pad["LED_CHANNELS"])
+    ## Unlock and select page 0, left on page 2 by the setup, then one write
+    assert after.transactions == 3
+    assert led_registers(pad, after) == led_registers(pad, before)
+
+
+def test_repaint_only_sends_changes():
+    pad = fake_board.load()
+    colors = all_colors(pad, "a1b2c3")
+    repaint_after(pad, colors)
+
+    assert repaint_after(pad, colors).transactions == 0
+
+    colors["d2"] = "0000ff"
+    i2c = repaint_after(pad, colors)
+    assert i2c.transactions == 1
+    assert i2c.bytes_written <= 1 + 3
+    assert led_registers(pad, i2c) == led_registers(pad, repaint_before(pad, colors))
+
+
+if __name__ == "__main__":
+    pad = fake_board.load()
+    colors = all_colors(pad, "a1b2c3")
+    before = repaint_before(pad, colors)
+    after = repaint_after(pad, colors)
+    print(f"{'full repaint':<14}{'transactions':>14}{'bytes written':>15}")
+    print(f"{'before':<14}{before.transactions:>14}{before.bytes_written:>15}")
+    print(f"{'after':<14}{after.transactions:>14}{after.bytes_written:>15}")
@@ -0,0 +1,116 @@
+"""Slow writer test of the incremental serial receiver.
+
+The host side trickles a mix of JSON lines, text commands and binary
+profiles into the fake usb_cdc port in USB sized pieces, with a scan
+between pieces. Only complete messages may reach serial_message(), intact
+and in order, across the end of the ring buffer and around messages too
+large for it.
+"""
+
+import json
+import random
+
+import fake_board
+
+
+def recording_receiver():
+    ## Each message, and whether it crossed the end of the ring buffer
+    return fake_board.recording_pad("serial_message", lambda pad, data: (
+        data, pad["rx_start"] + pad["rx_len"] > pad["RX_BUFFER_SIZE"]
+    ))
+
+
+def messages(received):
+    return [data for data, _ in received]
+
+
+def random_messages(rng, count):
+    messages = []
+    for index in range(count):
+        kind = rng.randrange(3)
+        if kind == 0:
+            keys = {"a%d" % n: "x" * rng.randrange(200) for n in range(rng.randrange(1, 8))}
+            messages.append(json.dumps({"colors": {}, "keys": keys, "n": index}).encode())
+        elif kind == 1:
+            messages.append(b"ACTIVATE %08x" % rng.getrandbits(32))
+        else:
+            ## Binary bodies may hold newlines and magic bytes anywhere
+            body = bytes(rng.choice(b"\n\xa5\xa6ab") for _ in range(rng.randrange(1, 1500)))
+            messages.append(fake_board.wire_frame(body, rng.choice((0xA5, 0xA6))))
+    return messages
+
+
+def encode(message):
+    return message if message[0] in (0xA5, 0xA6) else message + b"\n"
+
+
+def trickle(pad, stream, rng, largest=64):
+    ## At most one USB packet arrives between two passes of the main loop
+    pos = 0
+    while pos < len(stream):
+        size = rng.randint(1, largest)
+        fake_board.SERIAL.rx += stream[pos:pos + size]
+        pos += size
+        pad["serial_receive"]()
+        ## Whatever was waiting has been taken, the loop never waits for more
+        assert fake_board.SERIAL.in_waiting == 0
+        pad["matrix_scan"]()
+
+
+def test_slow_writer_delivers_whole_messages_in_order():
+    pad, received = recording_receiver()
+    rng = random.Random(10)
+    sent = random_messages(rng, 300)
+    stream = b"".join(encode(message) for message in sent)
+    assert len(stream) > 10 * pad["RX_BUFFER_SIZE"]
+
+    trickle(pad, stream, rng)
+
+    assert messages(received) == sent
+    assert any(wrapped for _, wrapped in received), "no message crossed the end of the ring buffer"
+    assert pad["rx_len"] == 0
+    assert pad["RX_OVERFLOWS"] == 0
+
+
+def test_single_byte_writes():
+    pad, received = recording_receiver()
+    rng = random.Random(1)
+    sent = random_messages(rng, 40)
+
+    trickle(pad, b"".join(encode(message) for message in sent), rng, largest=1)
+
+    assert messages(received) == sent
+
+
+def test_oversized_messages_are_dropped_without_losing_the_others():
+    pad, received = recording_receiver()
+    rng = random.Random(8192)
+    size = pad["RX_BUFFER_SIZE"]
+    before = random_messages(rng, 20)
+    between = random_messages(rng, 20)
+    after = random_messages(rng, 20)
+    too_long_json = json.dumps({"keys": {"a1": "x" * (2 * size)}}).encode()
+    too_long_frame = fake_board.wire_frame(b"\n" * (size + 100))
+
+    stream = b"".join(encode(message) for message in before)
+    stream += encode(too_long_json)
+    stream += b"".join(encode(message) for message in between)
+    stream += too_long_frame
+    stream += b"".join(encode(message) for message in after)
+    trickle(pad, stream, rng, largest=512)
+
+    assert messages(received) == before + between + after
+    assert pad["RX_OVERFLOWS"] == 2
+
+
+def test_largest_message_that_fits():
+    pad, received = recording_receiver()
+    rng = random.Random(3)
+    ## Buffer sized line including its newline, and a frame filling the buffer
+    line = b"{" + b" " * (pad["RX_BUFFER_SIZE"] - 3) + b"}"
+    frame = fake_board.wire_frame(b"z" * (pad["RX_BUFFER_SIZE"] - 8))
+
+    trickle(pad, b"ACTIVATE 00000001\n" + line + b"\n" + frame + b"LOAD default\n", rng)
+
+    assert messages(received) == [b"ACTIVATE 00000001", line, frame, b"LOAD default"]
+    assert pad["RX_OVERFLOWS"] == 0
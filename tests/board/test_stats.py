@@ -0,0 +1,39 @@
+"""Latency instrumentation is off until the host asks for it.
+
+Each sample allocates on CircuitPython, so plain STATS requests only get
+the counters. STATS ON starts the timing, and every report gives the cost
+of one sample in time and in heap bytes.
+"""
+
+import json
+
+import fake_board
+
+
+def stats(pad, command=b"STATS"):
+    pad["serial_message"](command)
+    return json.loads(fake_board.SERIAL.replies()[-1])["stats"]
+
+
+def tap_keys(pad, count):
+    for _ in range(count):
+        fake_board.press(pad, "a1")
+        fake_board.loop_pass(pad)
+        fake_board.release(pad, "a1")
+        fake_board.loop_pass(pad)
+
+
+def test_timing_starts_with_stats_on():
+    pad = fake_board.load()
+    tap_keys(pad, 5)
+    report = stats(pad)
+    assert not report["enabled"]
+    assert report["key"]["n"] == 0
+    assert report["overhead_bytes"] == 0
+
+    stats(pad, b"STATS ON")
+    tap_keys(pad, 5)
+    report = stats(pad)
+    assert report["enabled"]
+    assert report["key"]["n"] == 10
+    assert "overhead_ns" in report and "overhead_bytes" in report